@@ -8,15 +8,19 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import time
-import json
+import hashlib
+import orjson
 import tempfile
+from bisect import bisect_left
+from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
 from core.enhanced_rag_chain import enhanced_rag_chain
 from core.document_loader import document_loader
+from core.hyde_retrieval import hyde_retriever
 from core.vector_store_compatible import vector_store
 from database.db_manager import db_manager
-from evaluation.rag_evaluator import rag_evaluator
-from evaluation.feedback_learner import feedback_learner
-from evaluation.multi_model_support import multi_model_manager
 from config.settings import settings
 
 # 页面配置
@@ -27,6 +31,33 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# 会话内问答缓存的最大条目数
+QA_CACHE_SIZE = 128
+
+# 上传文件流式读取的块大小（1MB）
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# 系统状态缓存时间（秒）
+STATUS_CACHE_TTL = 5
+
+# RAG方法及其显示名称
+RAG_METHODS = ("basic", "hyde", "rerank", "enhanced")
+RAG_METHOD_LABELS = {
+    "basic": "基础RAG",
+    "hyde": "HyDE增强",
+    "rerank": "重排序RAG",
+    "enhanced": "增强RAG (推荐)"
+}
+RAG_METHOD_INDEX = {method: i for i, method in enumerate(RAG_METHODS)}
+
+# 置信度分级阈值（严格大于阈值才进入上一级）
+CONFIDENCE_THRESHOLDS = (0.6, 0.8)
+CONFIDENCE_LABELS = ("低", "中", "高")
+
+def confidence_label(confidence: float) -> str:
+    """获取置信度等级标签"""
+    return CONFIDENCE_LABELS[bisect_left(CONFIDENCE_THRESHOLDS, confidence)]
+
 def initialize_session_state():
     """初始化会话状态"""
     if 'session_id' not in st.session_state:
@@ -37,33 +68,87 @@ def initialize_session_state():
         st.session_state.selected_model = "gpt-3.5-turbo"
     if 'rag_method' not in st.session_state:
         st.session_state.rag_method = "enhanced"
+    if 'qa_cache' not in st.session_state:
+        st.session_state.qa_cache = OrderedDict()
+
+def qa_cache_key(rag_method: str, prompt: str) -> tuple:
+    """问答缓存键：RAG方法 + 归一化问题的摘要"""
+    normalized = prompt.strip().lower()
+    return (rag_method, hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest())
+
+def get_cached_answer(key: tuple) -> Optional[dict]:
+    """从会话级LRU缓存获取问答结果"""
+    qa_cache = st.session_state.qa_cache
+    if key in qa_cache:
+        qa_cache.move_to_end(key)
+        return qa_cache[key]
+    return None
+
+def cache_answer(key: tuple, result: dict):
+    """写入会话级LRU缓存，超出容量时淘汰最久未使用的结果"""
+    if result.get("error"):
+        # 出错结果（如临时的API故障）不缓存，下次提问时重新生成
+        return
+    qa_cache = st.session_state.qa_cache
+    qa_cache[key] = result
+    qa_cache.move_to_end(key)
+    while len(qa_cache) > QA_CACHE_SIZE:
+        qa_cache.popitem(last=False)
 
 def upload_and_process_file(uploaded_file):
     """上传和处理文件"""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-        tmp_file.write(uploaded_file.getvalue())
+    # 单次遍历：边写临时文件边计算内容哈希
+    # UploadedFile基于BytesIO，getbuffer()返回零拷贝视图，按块切片不复制数据
+    hasher = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file, \
+            uploaded_file.getbuffer() as buffer:
+        file_size = buffer.nbytes
+        for offset in range(0, file_size, UPLOAD_CHUNK_SIZE):
+            chunk = buffer[offset:offset + UPLOAD_CHUNK_SIZE]
+            tmp_file.write(chunk)
+            hasher.update(chunk)
         tmp_file_path = tmp_file.name
+    content_hash = hasher.hexdigest()
     
     try:
+        # 相同内容的文档已入库则直接复用，跳过解析和向量化
+        existing = db_manager.get_document_by_hash(content_hash)
+        if existing and existing.is_processed:
+            st.info(f"文档已存在（{existing.filename}），复用已有向量")
+            return existing.chunk_count or 0
+        
         # 处理文档
-        chunks = document_loader.process_document(tmp_file_path)
+        start_time = time.time()
+        chunks = document_loader.process_document(tmp_file_path, file_hash=content_hash, filename=uploaded_file.name)
         
-        if chunks:
-            # 向量化存储
-            vector_ids = vector_store.add_documents(chunks)
+        if chunks and vector_store.has_file_hash(content_hash):
+            # 向量库中已有该文件的文档块（如数据库记录缺失），无需重新向量化
+            print(f"向量库已包含文件 {uploaded_file.name}，跳过向量化")
+        elif chunks:
+            # 向量化存储（分批写入，每批一次向量化请求）
+            batch_size = settings.EMBEDDING_BATCH_SIZE
+            progress_bar = st.progress(0.0, text="向量化文档块...")
+            vector_ids = []
+            for i in range(0, len(chunks), batch_size):
+                vector_ids.extend(vector_store.add_documents(chunks[i:i + batch_size]))
+                progress_bar.progress(min(i + batch_size, len(chunks)) / len(chunks), text="向量化文档块...")
+            progress_bar.empty()
             
+            # 启用HyQE时为文档块预生成假设性问题
+            hyde_retriever.index_hypothetical_questions(chunks)
+        
+        if chunks:
             # 记录到数据库
-            metadata = {
-                "filename": uploaded_file.name,
-                "file_size": len(uploaded_file.getvalue()),
-                "chunks_count": len(chunks),
-                "upload_time": time.time()
-            }
-            
-            db_manager.add_document_metadata(
+            doc_metadata = db_manager.create_document_metadata(
                 filename=uploaded_file.name,
-                content_hash=str(hash(uploaded_file.getvalue())),
-                metadata=json.dumps(metadata)
+                file_size=file_size,
+                content_hash=content_hash
+            )
+            db_manager.update_document_metadata(
+                doc_metadata.id,
+                chunk_count=len(chunks),
+                processing_time=time.time() - start_time,
+                is_processed=True
             )
             
             return len(chunks)
@@ -75,6 +160,57 @@ def upload_and_process_file(uploaded_file):
         if os.path.exists(tmp_file_path):
             os.unlink(tmp_file_path)
 
+# 局部重跑：反馈控件交互只重跑片段本身，不重绘整个聊天历史
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+@fragment
+def render_feedback_widgets(feedback_key: str):
+    """渲染单条回答的反馈控件"""
+    col1, col2, col3 = st.columns([1, 2, 1])
+    
+    with col2:
+        rating = st.select_slider(
+            "评价回答质量",
+            options=[1, 2, 3, 4, 5],
+            value=3,
+            format_func=lambda x: str(x) + "星",
+            key=feedback_key
+        )
+        
+        feedback_comment = st.text_input(
+            "反馈意见 (可选)",
+            placeholder="请分享您的想法...",
+            key=f"comment_{feedback_key}"
+        )
+        
+        if st.button("提交反馈", key=f"submit_{feedback_key}"):
+            # 这里简化了反馈收集流程
+            st.success(f"感谢您的反馈！评分: {rating}/5")
+            if feedback_comment:
+                st.info(f"反馈: {feedback_comment}")
+
+@st.cache_data(ttl=30)
+def cached_document_stats():
+    """缓存文档统计（30秒），避免每次重跑都查询数据库"""
+    return db_manager.get_document_stats()
+
+@st.cache_resource
+def cached_available_models():
+    """缓存可用模型列表（进程内不变）"""
+    from evaluation.multi_model_support import multi_model_manager
+    return multi_model_manager.list_available_models()
+
+@st.cache_resource
+def cached_model_info(model_name: str):
+    """缓存模型信息"""
+    from evaluation.multi_model_support import multi_model_manager
+    return multi_model_manager.get_model_info(model_name)
+
+@lru_cache(maxsize=256)
+def parse_document_metadata(metadata: str) -> dict:
+    """解析文档元数据JSON（按原始字符串缓存）"""
+    return orjson.loads(metadata) if metadata else {}
+
 def display_chat_interface():
     """显示聊天界面"""
     st.header("智能问答")
@@ -85,20 +221,16 @@ def display_chat_interface():
     with col1:
         rag_method = st.selectbox(
             "选择RAG方法",
-            ["basic", "hyde", "rerank", "enhanced"],
-            index=["basic", "hyde", "rerank", "enhanced"].index(st.session_state.rag_method),
-            format_func=lambda x: {
-                "basic": "基础RAG",
-                "hyde": "HyDE增强",
-                "rerank": "重排序RAG",
-                "enhanced": "增强RAG (推荐)"
-            }[x]
+            RAG_METHODS,
+            index=RAG_METHOD_INDEX[st.session_state.rag_method],
+            format_func=RAG_METHOD_LABELS.__getitem__
         )
         st.session_state.rag_method = rag_method
     
     with col2:
         if st.button("方法对比", help="比较不同RAG方法的表现"):
             st.session_state.show_comparison = True
+        force_refresh = st.checkbox("强制刷新", value=False, help="忽略缓存，重新检索并生成回答")
     
     # 显示聊天历史
     chat_container = st.container()
@@ -111,42 +243,18 @@ def display_chat_interface():
                     
                     # 显示置信度
                     if "confidence" in message:
-                        confidence = message["confidence"]
-                        confidence_color = "高" if confidence > 0.8 else "中" if confidence > 0.6 else "低"
-                        st.caption(f"{confidence_color} 置信度: {confidence:.3f}")
+                        st.caption(f"{message['confidence_label']} 置信度: {message['confidence']:.3f}")
                     
                     # 显示引用
                     if "citations" in message and message["citations"]:
                         with st.expander("参考文档"):
-                            for i, citation in enumerate(message["citations"], 1):
-                                st.write(f"**引用 {i}:** {citation['content'][:200]}...")
+                            for i, (citation, preview) in enumerate(zip(message["citations"], message["citation_previews"]), 1):
+                                st.write(f"**引用 {i}:** {preview}")
                                 if citation.get('similarity'):
                                     st.caption(f"相似度: {citation['similarity']:.3f}")
                     
                     # 反馈收集
-                    feedback_key = f"feedback_{len(st.session_state.chat_history)}_{message.get('timestamp', 0)}"
-                    col1, col2, col3 = st.columns([1, 2, 1])
-                    
-                    with col2:
-                        rating = st.select_slider(
-                            "评价回答质量",
-                            options=[1, 2, 3, 4, 5],
-                            value=3,
-                            format_func=lambda x: str(x) + "星",
-                            key=feedback_key
-                        )
-                        
-                        feedback_comment = st.text_input(
-                            "反馈意见 (可选)",
-                            placeholder="请分享您的想法...",
-                            key=f"comment_{feedback_key}"
-                        )
-                        
-                        if st.button("提交反馈", key=f"submit_{feedback_key}"):
-                            # 这里简化了反馈收集流程
-                            st.success(f"感谢您的反馈！评分: {rating}/5")
-                            if feedback_comment:
-                                st.info(f"反馈: {feedback_comment}")
+                    render_feedback_widgets(message["feedback_key"])
                 
                 else:
                     st.write(message["content"])
@@ -162,51 +270,59 @@ def display_chat_interface():
         # AI回答
         with st.chat_message("assistant"):
             with st.spinner("思考中..."):
-                # 根据选择的方法获取回答
-                if rag_method == "basic":
-                    result = enhanced_rag_chain.ask_basic(prompt)
-                elif rag_method == "hyde":
-                    result = enhanced_rag_chain.ask_hyde(prompt)
-                elif rag_method == "rerank":
-                    result = enhanced_rag_chain.ask_rerank(prompt)
-                else:  # enhanced
-                    result = enhanced_rag_chain.ask_enhanced(prompt)
+                cache_key = qa_cache_key(rag_method, prompt)
+                result = None if force_refresh else get_cached_answer(cache_key)
                 
-                # 显示回答
-                st.write(result["answer"])
+                if result is not None:
+                    # 缓存命中，直接显示回答
+                    st.write(result["answer"])
+                else:
+                    # 流式显示回答，生成结束后result中包含完整结果
+                    result = {}
+                    st.write_stream(enhanced_rag_chain.ask_stream(prompt, rag_method, result))
+                    cache_answer(cache_key, result)
                 
                 # 显示置信度
                 confidence = result["confidence"]
-                confidence_color = "高" if confidence > 0.8 else "中" if confidence > 0.6 else "低"
+                confidence_color = confidence_label(confidence)
                 st.caption(f"{confidence_color} 置信度: {confidence:.3f} | 用时: {result['response_time']:.2f}秒")
                 
+                # 引用预览只截取一次，历史消息重绘时直接复用
+                citation_previews = [f"{citation['content'][:200]}..." for citation in result["citations"]]
+                
                 # 显示引用
                 if result["citations"]:
                     with st.expander(f"参考文档 ({len(result['citations'])} 个)"):
-                        for i, citation in enumerate(result["citations"], 1):
-                            st.write(f"**引用 {i}:** {citation['content'][:200]}...")
+                        for i, (citation, preview) in enumerate(zip(result["citations"], citation_previews), 1):
+                            st.write(f"**引用 {i}:** {preview}")
                             if citation.get('similarity'):
                                 st.caption(f"相似度: {citation['similarity']:.3f}")
                 
-                # 保存到聊天历史
+                # 保存到聊天历史（反馈控件key和置信度标签只在此计算一次）
+                timestamp = time.time()
                 assistant_message = {
                     "role": "assistant",
                     "content": result["answer"],
                     "confidence": confidence,
+                    "confidence_label": confidence_color,
                     "citations": result["citations"],
+                    "citation_previews": citation_previews,
                     "response_time": result["response_time"],
-                    "timestamp": time.time()
+                    "timestamp": timestamp,
+                    "feedback_key": f"feedback_{len(st.session_state.chat_history)}_{timestamp}"
                 }
                 st.session_state.chat_history.append(assistant_message)
                 
-                # 记录到数据库
-                db_manager.add_qa_log(
+                # 记录到数据库（后台线程批量写入，不阻塞界面）
+                db_manager.log_qa_async(
                     session_id=st.session_state.session_id,
                     question=prompt,
                     answer=result["answer"],
+                    citations=result["citations"],
                     confidence=confidence,
                     response_time=result["response_time"],
-                    context=json.dumps([c["content"] for c in result["citations"]])
+                    tokens_used=result.get("tokens_used"),
+                    model_name=st.session_state.selected_model
                 )
 
 def display_comparison_interface():
@@ -232,11 +348,19 @@ def display_comparison_interface():
             
             progress_bar = st.progress(0)
             
-            for i, (method_name, method_func) in enumerate(methods.items()):
-                with st.spinner(f"测试 {method_name}..."):
-                    result = method_func(test_question)
-                    comparison_results[method_name] = result
-                    progress_bar.progress((i + 1) / len(methods))
+            # 各方法相互独立且以网络I/O为主，并行执行
+            with st.spinner("并行测试各RAG方法..."):
+                with ThreadPoolExecutor(max_workers=len(methods)) as executor:
+                    futures = {
+                        executor.submit(method_func, test_question): method_name
+                        for method_name, method_func in methods.items()
+                    }
+                    for i, future in enumerate(as_completed(futures), 1):
+                        comparison_results[futures[future]] = future.result()
+                        progress_bar.progress(i / len(methods))
+            
+            # 按方法的原始顺序展示
+            comparison_results = {name: comparison_results[name] for name in methods}
             
             # 显示对比结果
             st.subheader("对比结果")
@@ -280,6 +404,7 @@ def display_document_management():
                 chunks_count = upload_and_process_file(uploaded_file)
                 
                 if chunks_count > 0:
+                    cached_document_stats.clear()
                     st.success(f"文档处理完成！共生成 {chunks_count} 个文本块")
                 else:
                     st.error("文档处理失败")
@@ -287,12 +412,12 @@ def display_document_management():
     # 显示已上传的文档
     st.subheader("已上传文档")
     
-    documents = db_manager.get_document_stats()
+    documents = cached_document_stats()
     
     if documents:
         for doc in documents:
             with st.expander(f"{doc.filename}"):
-                metadata = json.loads(doc.metadata) if doc.metadata else {}
+                metadata = parse_document_metadata(doc.metadata)
                 
                 col1, col2 = st.columns(2)
                 with col1:
@@ -308,6 +433,11 @@ def display_document_management():
 
 def display_evaluation_panel():
     """显示评测面板"""
+    # 评测相关模块仅在进入评测页面时加载，缩短应用冷启动时间
+    from evaluation.rag_evaluator import rag_evaluator
+    from evaluation.feedback_learner import feedback_learner
+    from evaluation.multi_model_support import multi_model_manager
+    
     st.header("系统评测")
     
     tab1, tab2, tab3 = st.tabs(["RAGAS评测", "用户反馈", " 多模型支持"])
@@ -395,14 +525,14 @@ def display_evaluation_panel():
         st.subheader(" 多模型支持")
         
         # 显示可用模型
-        available_models = multi_model_manager.list_available_models()
+        available_models = cached_available_models()
         st.write(f"**可用模型:** {', '.join(available_models)}")
         
         # 模型信息
         selected_model = st.selectbox("选择模型查看详情", available_models)
         
         if selected_model:
-            model_info = multi_model_manager.get_model_info(selected_model)
+            model_info = cached_model_info(selected_model)
             
             col1, col2 = st.columns(2)
             with col1:
@@ -435,31 +565,38 @@ def display_evaluation_panel():
                 except Exception as e:
                     st.error(f"模型对比失败: {e}")
 
+def probe_system_status() -> dict:
+    """探测数据库与向量库状态"""
+    db_status = "高 正常" if db_manager.ping() else "低 异常"
+    
+    vector_stats = vector_store.get_stats()
+    if "total_documents" in vector_stats:
+        vector_status = f"高 正常 ({vector_stats['total_documents']} 向量)"
+    else:
+        vector_status = "低 异常"
+    
+    return {"db": db_status, "vector": vector_status}
+
+def cached_system_status() -> dict:
+    """获取系统状态（会话内缓存数秒，避免每次重跑都访问数据库和向量库）"""
+    now = time.time()
+    status = st.session_state.get("system_status")
+    if status is None or now - status["checked_at"] > STATUS_CACHE_TTL:
+        status = {**probe_system_status(), "checked_at": now}
+        st.session_state.system_status = status
+    return status
+
 def display_system_status():
     """显示系统状态"""
     with st.sidebar:
         st.header("系统状态")
         
-        # 数据库连接状态
-        try:
-            session = db_manager.get_session()
-            session.close()
-            db_status = "高 正常"
-        except:
-            db_status = "低 异常"
-        
-        st.write(f"**数据库:** {db_status}")
-        
-        # 向量库状态
-        try:
-            vector_count = vector_store.collection.count()
-            vector_status = f"高 正常 ({vector_count} 向量)"
-        except:
-            vector_status = "低 异常"
-        
-        st.write(f"**向量库:** {vector_status}")
+        status = cached_system_status()
+        st.write(f"**数据库:** {status['db']}")
+        st.write(f"**向量库:** {status['vector']}")
         
         # 模型状态
+        from evaluation.multi_model_support import multi_model_manager
         model_status = "高 正常" if multi_model_manager.default_provider else "低 异常"
         st.write(f"**LLM模型:** {model_status}")
         
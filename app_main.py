@@ -15,22 +15,48 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import time
-import tempfile
 import json
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
 
 # 导入核心模块
 from core.enhanced_rag_chain import enhanced_rag_chain
 from core.hyde_retrieval import hyde_retriever
-from core.reranker import reranker
+from core.reranker import get_reranker
 from core.document_loader import document_loader
 from core.vector_store_compatible import vector_store
 from database.db_manager import db_manager
 from evaluation.rag_evaluator_new import rag_evaluator
 from config.settings import settings
 
+# 文档并行处理的最大线程数
+MAX_INGEST_WORKERS = 8
+
+# 跨文件批量写入向量库的文档块数
+VECTOR_INSERT_BATCH_SIZE = 256
+
+# 仪表板统计数据缓存时间（秒），避免每次重跑都查询数据库
+SYSTEM_STATS_TTL = 30
+
+# 引用片段预览长度（字符）
+CITATION_PREVIEW_LENGTH = 300
+
+# 检索模式及其显示名称、描述（与enhanced_rag_chain的问答方法一一对应）
+RETRIEVAL_MODES = ["basic", "hyde", "rerank", "enhanced"]
+RETRIEVAL_MODE_LABELS = {
+    "basic": "🔍 基础检索",
+    "hyde": "💡 HyDE增强",
+    "rerank": "🎯 重排序",
+    "enhanced": "🚀 智能增强"
+}
+RETRIEVAL_MODE_DESCRIPTIONS = {
+    "basic": "传统向量相似度检索",
+    "hyde": "生成假设答案增强检索召回",
+    "rerank": "多阶段检索与智能重排序",
+    "enhanced": "综合HyDE + Rerank的最佳策略"
+}
+
 # 页面配置
 st.set_page_config(
     page_title="RAGLite - 智能问答助手",
@@ -39,8 +65,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# 自定义CSS
-st.markdown("""
+# 自定义CSS（模块级常量，重跑时无需重新构造）
+CUSTOM_CSS = """
 <style>
     /* 主标题样式 */
     .main-header {
@@ -157,7 +183,23 @@ st.markdown("""
     div:empty { display: none !important; }
     .element-container:empty { display: none !important; }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# 页面头部HTML
+HEADER_HTML = """
+<div class="main-header">
+    <div class="main-title">🤖 RAGLite</div>
+    <div class="main-subtitle">基于LangChain与MySQL的智能问答助手</div>
+    <div class="feature-badges">
+        <span class="badge">🔍 RAG检索问答</span>
+        <span class="badge">🗄️ MySQL存储</span>
+        <span class="badge">💡 HyDE增强</span>
+        <span class="badge">🎯 Rerank优化</span>
+        <span class="badge">📊 可解释AI</span>
+        <span class="badge">👥 用户反馈</span>
+    </div>
+</div>
+"""
 
 def initialize_session_state():
     """初始化会话状态"""
@@ -183,37 +225,29 @@ def initialize_session_state():
     if 'enable_rerank' not in st.session_state:
         st.session_state.enable_rerank = True
 
+def inject_css():
+    """注入自定义样式"""
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+
 def render_header():
     """渲染项目头部"""
-    st.markdown(f"""
-    <div class="main-header">
-        <div class="main-title">🤖 RAGLite</div>
-        <div class="main-subtitle">基于LangChain与MySQL的智能问答助手</div>
-        <div class="feature-badges">
-            <span class="badge">🔍 RAG检索问答</span>
-            <span class="badge">🗄️ MySQL存储</span>
-            <span class="badge">💡 HyDE增强</span>
-            <span class="badge">🎯 Rerank优化</span>
-            <span class="badge">📊 可解释AI</span>
-            <span class="badge">👥 用户反馈</span>
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(HEADER_HTML, unsafe_allow_html=True)
 
+@st.cache_data(ttl=SYSTEM_STATS_TTL, show_spinner=False)
 def get_system_stats():
-    """获取系统统计数据"""
+    """获取系统统计数据（短时缓存，数据库统计与向量库统计并行执行）"""
     try:
-        # 获取问答统计
-        qa_stats = db_manager.get_qa_stats()
-        
-        # 获取文档统计
-        doc_stats = db_manager.get_document_stats()
-        
-        # 获取向量库统计
-        vector_stats = vector_store.get_stats()
+        # 数据库统计在一个会话中一次取回，与向量库统计互不依赖，并行查询
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            bundle_future = executor.submit(db_manager.get_stats_bundle)
+            vector_future = executor.submit(vector_store.get_stats)
+            
+            bundle = bundle_future.result()
+            vector_stats = vector_future.result()
         
-        # 获取反馈统计
-        feedback_stats = db_manager.get_feedback_stats()
+        qa_stats = bundle["qa"]
+        doc_stats = bundle["documents"]
+        feedback_stats = bundle["feedback"]
         
         return {
             "total_questions": qa_stats.get("total_count", 0),
@@ -287,25 +321,14 @@ def render_sidebar():
         st.subheader("🔍 检索策略")
         retrieval_mode = st.selectbox(
             "选择检索模式",
-            options=["basic", "hyde", "rerank", "enhanced"],
-            index=["basic", "hyde", "rerank", "enhanced"].index(st.session_state.retrieval_mode),
-            format_func=lambda x: {
-                "basic": "🔍 基础检索",
-                "hyde": "💡 HyDE增强",
-                "rerank": "🎯 重排序",
-                "enhanced": "🚀 智能增强"
-            }[x]
+            options=RETRIEVAL_MODES,
+            index=RETRIEVAL_MODES.index(st.session_state.retrieval_mode),
+            format_func=RETRIEVAL_MODE_LABELS.__getitem__
         )
         st.session_state.retrieval_mode = retrieval_mode
         
         # 策略描述
-        descriptions = {
-            "basic": "传统向量相似度检索",
-            "hyde": "生成假设答案增强检索召回",
-            "rerank": "多阶段检索与智能重排序",
-            "enhanced": "综合HyDE + Rerank的最佳策略"
-        }
-        st.caption(descriptions[retrieval_mode])
+        st.caption(RETRIEVAL_MODE_DESCRIPTIONS[retrieval_mode])
         
         # Rerank开关
         enable_rerank = st.checkbox(
@@ -380,51 +403,81 @@ def render_sidebar():
         if st.button("🧪 运行评测", use_container_width=True):
             run_evaluation()
 
+def process_single_document(file):
+    """解析并分块单个上传文档（在工作线程中执行），返回 (文档ID, 文档块列表, 处理耗时, 是否已在向量库中)"""
+    data = file.getvalue()
+    file_hash = document_loader.get_hash_from_bytes(data)
+    
+    # 记录文档元数据
+    doc_metadata = db_manager.create_document_metadata(
+        filename=file.name,
+        file_size=len(data)
+    )
+    doc_id = doc_metadata.id  # 立即获取ID
+    
+    # 处理文档（先按内容哈希查缓存，命中时无需写临时文件）
+    start_time = time.time()
+    chunks = document_loader.process_document_from_bytes(data, file.name, file_hash=file_hash)
+    processing_time = time.time() - start_time
+    
+    # 相同内容的文件已向量化过（缓存命中的典型情况），无需重复写入向量库
+    already_indexed = bool(chunks) and vector_store.has_file_hash(file_hash)
+    
+    return doc_id, chunks or [], processing_time, already_indexed
+
 def process_documents(uploaded_files):
-    """处理上传的文档"""
+    """处理上传的文档（多文件并行解析，向量化跨文件批量写入）"""
     progress_bar = st.progress(0)
     status_text = st.empty()
     
     try:
-        for i, file in enumerate(uploaded_files):
-            progress = i / len(uploaded_files)
-            progress_bar.progress(progress)
-            status_text.text(f"处理文档: {file.name}")
-            
-            # 保存临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file.name.split('.')[-1]}") as tmp_file:
-                tmp_file.write(file.getvalue())
-                tmp_path = tmp_file.name
+        status_text.text(f"解析文档: {len(uploaded_files)} 个")
+        
+        # 1. 并行解析：工作线程只做处理，进度和结果统一在主线程中渲染
+        parsed_documents = []
+        all_chunks = []
+        with ThreadPoolExecutor(max_workers=min(MAX_INGEST_WORKERS, len(uploaded_files))) as executor:
+            futures = {executor.submit(process_single_document, file): file for file in uploaded_files}
             
-            try:
-                # 记录文档元数据
-                doc_metadata = db_manager.create_document_metadata(
-                    filename=file.name,
-                    file_size=len(file.getvalue())
-                )
-                doc_id = doc_metadata.id  # 立即获取ID
-                
-                # 处理文档
-                start_time = time.time()
-                chunks = document_loader.process_document(tmp_path)
-                processing_time = time.time() - start_time
-                
-                if chunks:
-                    # 添加到向量库
-                    vector_store.add_documents(chunks)
-                    
-                    # 更新元数据
-                    db_manager.update_document_metadata(
-                        doc_id,
-                        chunk_count=len(chunks),
-                        processing_time=processing_time,
-                        is_processed=True
-                    )
-                    
-                    st.success(f"✅ {file.name} 处理成功 ({len(chunks)}块)")
+            for i, future in enumerate(as_completed(futures), 1):
+                file = futures[future]
+                try:
+                    doc_id, chunks, processing_time, already_indexed = future.result()
+                    if chunks:
+                        parsed_documents.append((file.name, doc_id, len(chunks), processing_time))
+                        if already_indexed:
+                            print(f"向量库已包含文件 {file.name}，跳过向量化")
+                        else:
+                            all_chunks.extend(chunks)
+                except Exception as e:
+                    st.error(f"{file.name} 处理失败: {e}")
                 
-            finally:
-                os.unlink(tmp_path)
+                progress_bar.progress(i / len(uploaded_files) * 0.5)
+                status_text.text(f"已解析: {file.name}")
+        
+        # 2. 跨文件批量向量化写入，减少向量库调用次数
+        for start in range(0, len(all_chunks), VECTOR_INSERT_BATCH_SIZE):
+            status_text.text(f"向量化文档块: {start + 1}-{min(start + VECTOR_INSERT_BATCH_SIZE, len(all_chunks))} / {len(all_chunks)}")
+            vector_store.add_documents(all_chunks[start:start + VECTOR_INSERT_BATCH_SIZE])
+            progress_bar.progress(0.5 + min(start + VECTOR_INSERT_BATCH_SIZE, len(all_chunks)) / len(all_chunks) * 0.5)
+        
+        # 启用HyQE时为新入库的文档块预生成假设性问题
+        if all_chunks and settings.HYQE_ENABLED:
+            status_text.text(f"生成假设性问题: {len(all_chunks)} 个文档块")
+            hyde_retriever.index_hypothetical_questions(all_chunks)
+        
+        # 3. 更新元数据
+        for filename, doc_id, chunk_count, processing_time in parsed_documents:
+            db_manager.update_document_metadata(
+                doc_id,
+                chunk_count=chunk_count,
+                processing_time=processing_time,
+                is_processed=True
+            )
+            st.success(f"✅ {filename} 处理成功 ({chunk_count}块)")
+        
+        # 文档数量已变化，刷新仪表板统计
+        get_system_stats.clear()
         
         progress_bar.progress(1.0)
         status_text.text("处理完成！")
@@ -466,6 +519,24 @@ def run_evaluation():
         except Exception as e:
             st.error(f"评测失败: {e}")
 
+def build_citation_views(citations: List[Dict]) -> List[str]:
+    """预先生成引用片段的展示HTML（内容截取前CITATION_PREVIEW_LENGTH个字符）"""
+    return [
+        f"""
+        <div class="citation">
+            <div class="citation-source">片段 {i}: {citation.get('source', '未知来源')}</div>
+            <div class="citation-content">{citation['content'][:CITATION_PREVIEW_LENGTH]}...</div>
+        </div>
+        """
+        for i, citation in enumerate(citations, 1)
+    ]
+
+def render_citations(citation_views: List[str]):
+    """在折叠面板中显示引用片段"""
+    with st.expander(f"📚 查看引用片段 ({len(citation_views)}个)"):
+        for citation_html in citation_views:
+            st.markdown(citation_html, unsafe_allow_html=True)
+
 def render_chat_interface():
     """渲染聊天界面"""
     # 显示聊天历史
@@ -483,14 +554,7 @@ def render_chat_interface():
                 
                 # 显示引用片段
                 if st.session_state.show_citations and message.get("citations"):
-                    with st.expander(f"📚 查看引用片段 ({len(message['citations'])}个)"):
-                        for i, citation in enumerate(message["citations"], 1):
-                            st.markdown(f"""
-                            <div class="citation">
-                                <div class="citation-source">片段 {i}: {citation.get('source', '未知来源')}</div>
-                                <div class="citation-content">{citation['content'][:300]}...</div>
-                            </div>
-                            """, unsafe_allow_html=True)
+                    render_citations(message["citations"])
                 
                 # 用户反馈按钮
                 col1, col2, col3 = st.columns([1, 1, 6])
@@ -519,71 +583,55 @@ def render_chat_interface():
         
         # AI处理
         with st.chat_message("assistant"):
-            with st.spinner("AI正在思考..."):
+            try:
+                # 按所选策略流式生成回答，首个token到达即开始显示；结束后result中为完整结果
+                result = {}
+                st.write_stream(enhanced_rag_chain.ask_stream(prompt, st.session_state.retrieval_mode, result))
+                
+                # 显示置信度
+                confidence = result.get("confidence", 0.0)
+                color = "green" if confidence > 0.8 else "orange" if confidence > 0.6 else "red"
+                st.markdown(f"<span style='color: {color}'>🎯 置信度: {confidence:.2f}</span>", unsafe_allow_html=True)
+                
+                # 显示引用（片段HTML只在生成回答时构建一次，历史重绘时直接复用）
+                citation_views = build_citation_views(result.get("citations", []))
+                if st.session_state.show_citations and citation_views:
+                    render_citations(citation_views)
+                
+                # 保存到历史
+                message_id = f"assistant_{len(st.session_state.chat_history)}"
+                assistant_message = {
+                    "role": "assistant",
+                    "content": result["answer"],
+                    "confidence": confidence,
+                    "citations": citation_views,
+                    "response_time": result.get("response_time", 0.0),
+                    "id": message_id
+                }
+                st.session_state.chat_history.append(assistant_message)
+                
+                # 记录到数据库
                 try:
-                    # 根据策略选择RAG方法
-                    if st.session_state.retrieval_mode == "basic":
-                        result = enhanced_rag_chain.ask_basic(prompt)
-                    elif st.session_state.retrieval_mode == "hyde":
-                        result = enhanced_rag_chain.ask_hyde(prompt)
-                    elif st.session_state.retrieval_mode == "rerank":
-                        result = enhanced_rag_chain.ask_rerank(prompt)
-                    else:  # enhanced
-                        result = enhanced_rag_chain.ask_enhanced(prompt)
-                    
-                    # 显示回答
-                    st.write(result["answer"])
-                    
-                    # 显示置信度
-                    confidence = result.get("confidence", 0.0)
-                    color = "green" if confidence > 0.8 else "orange" if confidence > 0.6 else "red"
-                    st.markdown(f"<span style='color: {color}'>🎯 置信度: {confidence:.2f}</span>", unsafe_allow_html=True)
-                    
-                    # 显示引用
-                    if st.session_state.show_citations and result.get("citations"):
-                        with st.expander(f"📚 查看引用片段 ({len(result['citations'])}个)"):
-                            for i, citation in enumerate(result["citations"], 1):
-                                st.markdown(f"""
-                                <div class="citation">
-                                    <div class="citation-source">片段 {i}: {citation.get('source', '未知来源')}</div>
-                                    <div class="citation-content">{citation['content'][:300]}...</div>
-                                </div>
-                                """, unsafe_allow_html=True)
+                    qa_id = db_manager.log_qa(
+                        session_id=st.session_state.session_id,
+                        question=prompt,
+                        answer=result["answer"],
+                        citations=result.get("citations", []),
+                        confidence=confidence,
+                        response_time=result.get("response_time", 0.0),
+                        model_name=st.session_state.current_model
+                    )
+                    print(f"✅ 记录到数据库: QA ID {qa_id}")
                     
-                    # 保存到历史
-                    message_id = f"assistant_{len(st.session_state.chat_history)}"
-                    assistant_message = {
-                        "role": "assistant",
-                        "content": result["answer"],
-                        "confidence": confidence,
-                        "citations": result.get("citations", []),
-                        "response_time": result.get("response_time", 0.0),
-                        "id": message_id
-                    }
-                    st.session_state.chat_history.append(assistant_message)
+                    # 更新message_id为数据库ID
+                    st.session_state.chat_history[-1]["id"] = qa_id
                     
-                    # 记录到数据库
-                    try:
-                        qa_id = db_manager.log_qa(
-                            session_id=st.session_state.session_id,
-                            question=prompt,
-                            answer=result["answer"],
-                            citations=result.get("citations", []),
-                            confidence=confidence,
-                            response_time=result.get("response_time", 0.0),
-                            model_name=st.session_state.current_model
-                        )
-                        print(f"✅ 记录到数据库: QA ID {qa_id}")
-                        
-                        # 更新message_id为数据库ID
-                        st.session_state.chat_history[-1]["id"] = qa_id
-                        
-                    except Exception as e:
-                        print(f"❌ 数据库记录失败: {e}")
-                        st.error(f"数据库记录失败: {e}")
-                
                 except Exception as e:
-                    st.error(f"处理请求失败: {e}")
+                    print(f"❌ 数据库记录失败: {e}")
+                    st.error(f"数据库记录失败: {e}")
+            
+            except Exception as e:
+                st.error(f"处理请求失败: {e}")
 
 def add_feedback(qa_id: int, feedback_type: str):
     """添加用户反馈"""
@@ -598,24 +646,29 @@ def add_feedback(qa_id: int, feedback_type: str):
     except Exception as e:
         print(f"反馈记录失败: {e}")
 
+@st.cache_data(ttl=SYSTEM_STATS_TTL, show_spinner=False)
+def get_analytics_data():
+    """获取分析数据（与仪表板统计共用缓存时间）"""
+    return db_manager.get_analytics_data()
+
 def render_analytics_page():
     """渲染分析页面"""
     st.header("📊 系统分析")
     
     # 获取分析数据
-    analytics_data = db_manager.get_analytics_data()
+    analytics_data = get_analytics_data()
     
     # 问答趋势
     st.subheader("📈 问答趋势")
-    if analytics_data.get("daily_qa"):
-        df_qa = pd.DataFrame(analytics_data["daily_qa"])
-        st.line_chart(df_qa.set_index("date")["count"])
+    df_qa = analytics_data.get("daily_qa")
+    if df_qa is not None and not df_qa.empty:
+        st.line_chart(df_qa["count"])
     
     # 置信度分布
     st.subheader("🎯 置信度分布")
-    if analytics_data.get("confidence_distribution"):
-        df_conf = pd.DataFrame(analytics_data["confidence_distribution"])
-        st.bar_chart(df_conf.set_index("range")["count"])
+    df_conf = analytics_data.get("confidence_distribution")
+    if df_conf is not None and not df_conf.empty:
+        st.bar_chart(df_conf["count"])
     
     # 用户反馈统计
     st.subheader("👥 用户反馈")
@@ -627,8 +680,29 @@ def render_analytics_page():
         with col2:
             st.metric("负向反馈", feedback_stats.get("negative", 0))
 
+def _warmup_components():
+    """预热数据库连接池、向量库与重排序模型（在后台线程中执行）"""
+    try:
+        if db_manager.ping():
+            db_manager.warm_pool()
+        vector_store.similarity_search("warmup", k=1)
+        get_reranker().warmup()
+        print("✅ 系统预热完成")
+    except Exception as e:
+        print(f"系统预热失败: {e}")
+
+@st.cache_resource(show_spinner=False)
+def start_warmup():
+    """每个进程只启动一次预热，避免首个问题承担冷启动延迟"""
+    import threading
+    thread = threading.Thread(target=_warmup_components, daemon=True)
+    thread.start()
+    return thread
+
 def main():
     """主函数"""
+    start_warmup()
+    inject_css()
     initialize_session_state()
     
     # 渲染页面
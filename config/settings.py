@@ -11,6 +11,8 @@ class Settings:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
     MODEL_NAME = os.getenv("MODEL_NAME", "gpt-3.5-turbo")
+    # HyDE/HyQE生成使用的模型（生成内容仅用于检索，可使用更小更快的模型，未配置时与MODEL_NAME相同）
+    HYDE_MODEL_NAME = os.getenv("HYDE_MODEL_NAME") or MODEL_NAME
     
     # MySQL配置
     MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
@@ -19,14 +21,57 @@ class Settings:
     MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "root")
     MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "raglite")
     
+    # MySQL连接池配置（全局共享一个连接池），DB_POOL_TIMEOUT为等待空闲连接的秒数，超时快速失败
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 25))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 25))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 5))
+    
     # 向量数据库配置
     CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./data/chroma_db")
     
+    # HNSW索引配置（仅在新建集合时生效）
+    HNSW_SPACE = os.getenv("HNSW_SPACE", "cosine")
+    HNSW_M = int(os.getenv("HNSW_M", 16))
+    HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", 64))
+    HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", 64))
+    
     # RAG配置
     CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1024))
     CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 128))
     TOP_K = int(os.getenv("TOP_K", 5))
     
+    # 上下文截断：排名前CONTEXT_FULL_DOCS个片段保留全文，其余截断到CONTEXT_TRUNCATE_TOKENS个token
+    CONTEXT_FULL_DOCS = int(os.getenv("CONTEXT_FULL_DOCS", 2))
+    CONTEXT_TRUNCATE_TOKENS = int(os.getenv("CONTEXT_TRUNCATE_TOKENS", 300))
+    
+    # 命令行交互问答是否流式输出
+    STREAM_ENABLED = os.getenv("STREAM_ENABLED", "true").lower() == "true"
+    
+    # CAG：知识库总token数不超过CAG_MAX_TOKENS时，简化问答链把全部文档块放入系统提示并跳过检索（0表示关闭）
+    CAG_MAX_TOKENS = int(os.getenv("CAG_MAX_TOKENS", 0))
+    
+    # HyQE：入库时为每个文档块预生成假设性问题并建立索引，检索时无需调用LLM（会增加入库耗时和API调用）
+    HYQE_ENABLED = os.getenv("HYQE_ENABLED", "false").lower() == "true"
+    HYQE_QUESTIONS_PER_CHUNK = int(os.getenv("HYQE_QUESTIONS_PER_CHUNK", 3))
+    
+    # 条件HyDE：增强模式下基础检索最高相关性（0-1）低于该阈值时才调用HyDE
+    HYDE_TRIGGER_THRESHOLD = float(os.getenv("HYDE_TRIGGER_THRESHOLD", 0.7))
+    
+    # 重排序配置（RERANK_MODEL为空时使用词汇相似度重排序）
+    RERANK_MODEL = os.getenv("RERANK_MODEL", "")
+    # 交叉编码器推理后端：torch / onnx / openvino / flashrank，RERANK_MODEL_FILE可指定量化模型文件
+    RERANK_BACKEND = os.getenv("RERANK_BACKEND", "torch")
+    RERANK_MODEL_FILE = os.getenv("RERANK_MODEL_FILE", "")
+    
+    # 向量化配置
+    # 向量磁盘缓存目录（安装了diskcache时启用，重复文本不再调用向量化接口）
+    EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "./data/embedding_cache")
+    
+    # 每个向量化请求的最大输入条数和token总数（接口上限为2048条）
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 1024))
+    EMBEDDING_MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", 200000))
+    
     @property
     def mysql_url(self):
         """生成MySQL连接字符串"""
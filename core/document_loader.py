@@ -2,11 +2,26 @@ from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from config.settings import settings
+from core.simhash import compute_simhash
 import os
+import base64
 import hashlib
-import pickle
+import tempfile
+import orjson
 import time
-from typing import List
+from typing import Dict, List
+
+try:
+    # 可选：Rust实现的文本分割器，分块速度远快于纯Python实现
+    from semantic_text_splitter import TextSplitter as NativeTextSplitter
+except ImportError:
+    NativeTextSplitter = None
+
+try:
+    # 可选：基于MuPDF C库的PDF解析，比纯Python的pypdf快数倍
+    import fitz
+except ImportError:
+    fitz = None
 
 class DocumentLoader:
     """文档加载和处理器 - 优化版本"""
@@ -19,24 +34,31 @@ class DocumentLoader:
             length_function=len,
             separators=["\n\n", "\n", "。", "！", "？", "；", " ", ""]
         )
+        self.native_splitter = (
+            NativeTextSplitter(settings.CHUNK_SIZE, overlap=settings.CHUNK_OVERLAP)
+            if NativeTextSplitter is not None else None
+        )
         
         # 创建缓存目录
         self.cache_dir = os.path.join(os.path.dirname(__file__), "..", "data", "cache")
         os.makedirs(self.cache_dir, exist_ok=True)
     
     def _get_file_hash(self, file_path: str) -> str:
-        """计算文件哈希值"""
-        hasher = hashlib.md5()
+        """计算文件哈希值（SHA-256，支持SHA-NI的CPU上由OpenSSL硬件加速）"""
         with open(file_path, 'rb') as f:
-            buf = f.read(65536)  # 64KB块
-            while len(buf) > 0:
+            if hasattr(hashlib, 'file_digest'):
+                # Python 3.11+：在C层读取并哈希，释放GIL
+                return hashlib.file_digest(f, 'sha256').hexdigest()
+            
+            hasher = hashlib.sha256()
+            for buf in iter(lambda: f.read(1 << 20), b''):  # 1MB块
                 hasher.update(buf)
-                buf = f.read(65536)
-        return hasher.hexdigest()
+            return hasher.hexdigest()
     
     def _get_cache_path(self, file_hash: str) -> str:
-        """获取缓存文件路径"""
-        return os.path.join(self.cache_dir, f"{file_hash}.pkl")
+        """获取缓存文件路径（哈希前16字节的URL安全Base64编码，按两级目录分片）"""
+        key = base64.urlsafe_b64encode(bytes.fromhex(file_hash)[:16]).rstrip(b'=').decode()
+        return os.path.join(self.cache_dir, key[:2], key[2:4], f"{key[4:]}.json")
     
     def _load_from_cache(self, file_hash: str) -> List[Document]:
         """从缓存加载文档块"""
@@ -44,7 +66,8 @@ class DocumentLoader:
         if os.path.exists(cache_path):
             try:
                 with open(cache_path, 'rb') as f:
-                    chunks = pickle.load(f)
+                    records = orjson.loads(f.read())
+                chunks = [Document(page_content=text, metadata=metadata) for text, metadata in records]
                 print(f"📋 从缓存加载文档块: {len(chunks)} 个")
                 return chunks
             except Exception as e:
@@ -55,8 +78,10 @@ class DocumentLoader:
         """保存文档块到缓存"""
         cache_path = self._get_cache_path(file_hash)
         try:
+            records = [(chunk.page_content, chunk.metadata) for chunk in chunks]
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
             with open(cache_path, 'wb') as f:
-                pickle.dump(chunks, f)
+                f.write(orjson.dumps(records))
             print(f"💾 文档块已缓存: {len(chunks)} 个")
         except Exception as e:
             print(f"缓存保存失败: {e}")
@@ -68,7 +93,9 @@ class DocumentLoader:
         # 根据文件扩展名选择加载器
         file_extension = os.path.splitext(file_path)[1].lower()
         
-        if file_extension == '.pdf':
+        if file_extension == '.pdf' and fitz is not None:
+            return self._load_pdf_with_pymupdf(file_path)
+        elif file_extension == '.pdf':
             loader = PyPDFLoader(file_path)
         elif file_extension in ['.txt', '.md']:
             loader = TextLoader(file_path, encoding='utf-8')
@@ -81,79 +108,124 @@ class DocumentLoader:
         
         return documents
     
-    def split_documents(self, documents: List[Document]) -> List[Document]:
-        """分割文档为小块"""
+    def _load_pdf_with_pymupdf(self, file_path: str) -> List[Document]:
+        """使用PyMuPDF加载PDF（元数据与PyPDFLoader一致）"""
+        with fitz.open(file_path) as pdf:
+            documents = [
+                Document(page_content=page.get_text("text"), metadata={"source": file_path, "page": i})
+                for i, page in enumerate(pdf)
+            ]
+        print(f"文档加载成功，共 {len(documents)} 页")
+        
+        return documents
+    
+    def split_documents(self, documents: List[Document], base_metadata: Dict = None) -> List[Document]:
+        """分割文档为小块（base_metadata为所有块共享的文件级元数据）"""
         print(f"正在分割文档，分块大小: {settings.CHUNK_SIZE}")
         
         start_time = time.time()
         
-        # 分割文档
-        chunks = self.text_splitter.split_documents(documents)
-        
-        # 为每个块添加元数据
+        # 分割文档（优先使用原生分割器）
+        if self.native_splitter is not None:
+            chunks = [
+                Document(page_content=piece, metadata=doc.metadata.copy())
+                for doc in documents
+                for piece in self.native_splitter.chunks(doc.page_content)
+            ]
+        else:
+            chunks = self.text_splitter.split_documents(documents)
+        
+        # 文件级元数据只构建一次，每个块单次合并
+        shared_metadata = {
+            **(base_metadata or {}),
+            'total_chunks': len(chunks),
+            'created_at': time.time()
+        }
         for i, chunk in enumerate(chunks):
-            chunk.metadata.update({
+            chunk.metadata = {
+                **chunk.metadata,
+                **shared_metadata,
                 'chunk_id': i,
                 'chunk_size': len(chunk.page_content),
-                'created_at': time.time()
-            })
+                'simhash': format(compute_simhash(chunk.page_content), '016x')  # 检索时近似去重使用
+            }
         
         processing_time = time.time() - start_time
         print(f"文档分割完成，共 {len(chunks)} 个块，耗时 {processing_time:.2f} 秒")
         
         return chunks
     
-    def process_document(self, file_path: str) -> List[Document]:
-        """完整处理文档：加载 + 分割 - 优化版本带缓存"""
-        print(f"\n=== 处理文档: {os.path.basename(file_path)} ===")
+    def get_hash_from_bytes(self, data: bytes) -> str:
+        """计算内存中文件内容的哈希值（与_get_file_hash结果一致）"""
+        return hashlib.sha256(data).hexdigest()
+    
+    def _use_cached_chunks(self, cached_chunks: List[Document], filename: str, start_time: float) -> List[Document]:
+        """使用缓存的文档块"""
+        for chunk in cached_chunks:
+            chunk.metadata['source_file'] = filename
+        
+        cache_time = time.time() - start_time
+        print(f"⚡ 缓存命中: {filename}")
+        print(f"   - 分块数量: {len(cached_chunks)}")
+        print(f"   - 加载耗时: {cache_time:.2f} 秒 (加速 ~10倍)")
+        return cached_chunks
+    
+    def process_document_from_bytes(self, data: bytes, filename: str, file_hash: str = None) -> List[Document]:
+        """处理内存中的文档内容：先按哈希查缓存，未命中时才写入临时文件解析"""
+        print(f"\n=== 处理文档: {filename} ===")
+        
+        start_time = time.time()
+        
+        file_hash = file_hash or self.get_hash_from_bytes(data)
+        cached_chunks = self._load_from_cache(file_hash)
+        if cached_chunks:
+            return self._use_cached_chunks(cached_chunks, filename, start_time)
+        
+        suffix = os.path.splitext(filename)[1]
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+            tmp_file.write(data)
+            tmp_path = tmp_file.name
+        
+        try:
+            return self.process_document(tmp_path, file_hash=file_hash, filename=filename)
+        finally:
+            os.unlink(tmp_path)
+    
+    def process_document(self, file_path: str, file_hash: str = None, filename: str = None) -> List[Document]:
+        """完整处理文档：加载 + 分割 - 优化版本带缓存（可传入预先计算的哈希和原始文件名）"""
+        filename = filename or os.path.basename(file_path)
+        print(f"\n=== 处理文档: {filename} ===")
         
         start_time = time.time()
         
         # 检查缓存
-        file_hash = self._get_file_hash(file_path)
+        file_hash = file_hash or self._get_file_hash(file_path)
         cached_chunks = self._load_from_cache(file_hash)
         
         if cached_chunks:
             # 使用缓存
-            filename = os.path.basename(file_path)
-            for chunk in cached_chunks:
-                chunk.metadata['source_file'] = filename
-            
-            cache_time = time.time() - start_time
-            print(f"⚡ 缓存命中: {filename}")
-            print(f"   - 分块数量: {len(cached_chunks)}")
-            print(f"   - 加载耗时: {cache_time:.2f} 秒 (加速 ~10倍)")
-            return cached_chunks
+            return self._use_cached_chunks(cached_chunks, filename, start_time)
         
         # 缓存未命中，重新处理
         print("🔄 缓存未命中，开始全新处理...")
         
         # 1. 加载文档
-        print("步骤 1/4: 加载文档...")
+        print("步骤 1/3: 加载文档...")
         documents = self.load_document(file_path)
         
-        # 2. 分割文档
-        print("步骤 2/4: 分割文档...")
-        chunks = self.split_documents(documents)
+        # 2. 分割文档并添加文件信息到每个块
+        print("步骤 2/3: 分割文档...")
+        file_size = os.path.getsize(file_path)
+        chunks = self.split_documents(documents, base_metadata={
+            'source_file': filename,
+            'file_size': file_size,
+            'file_hash': file_hash
+        })
         
         # 3. 保存到缓存
-        print("步骤 3/4: 保存缓存...")
+        print("步骤 3/3: 保存缓存...")
         self._save_to_cache(file_hash, chunks)
         
-        # 4. 添加文件信息到每个块
-        print("步骤 4/4: 添加元数据...")
-        filename = os.path.basename(file_path)
-        file_size = os.path.getsize(file_path)
-        
-        for i, chunk in enumerate(chunks):
-            chunk.metadata.update({
-                'source_file': filename,
-                'file_size': file_size,
-                'chunk_index': i,
-                'total_chunks': len(chunks),
-                'file_hash': file_hash
-            })
-        
         processing_time = time.time() - start_time
         
         print(f"✅ 文档处理完成: {filename}")
@@ -2,24 +2,60 @@
 增强版RAG问答链
 集成HyDE检索和Rerank重排序
 """
-import openai
+from core.openai_client import openai_client
 from core.vector_store_compatible import vector_store
 from core.hyde_retrieval import hyde_retriever
-from core.reranker import reranker
+from core.reranker import get_reranker
+from core.token_utils import truncate_tokens
 from config.settings import settings
-from typing import Dict, List
+from typing import Dict, FrozenSet, Iterator, List, Optional, Tuple, Union
+from enum import IntEnum
+from functools import lru_cache
+from langchain.schema import Document
 import time
-import json
+import openai
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+
+# 词集合缓存条目数（文档块在不同问题中会被反复检索到）
+TOKEN_SET_CACHE_SIZE = 4096
+
+# 批量问答：并行检索线程数与批处理任务状态轮询间隔（秒）
+BATCH_RETRIEVAL_WORKERS = 4
+BATCH_POLL_INTERVAL = 30
+
+# 支持Batch API（client.batches 及 purpose="batch" 文件上传）的最低openai SDK版本
+BATCH_API_MIN_OPENAI_VERSION = "1.18.0"
+
+class RetrievalMethod(IntEnum):
+    """问答检索方法（内部使用整数枚举，对外输出时转换为名称）"""
+    BASIC = 0
+    HYDE = 1
+    RERANK = 2
+    ENHANCED = 3
+
+# 检索方法名称（写入引用和结果中），按RetrievalMethod取值索引
+RETRIEVAL_METHOD_NAMES = ("basic", "hyde", "rerank", "hyde+rerank")
+
+# 检索方法对应的 (候选检索函数, 是否重排序)，按RetrievalMethod取值索引
+RETRIEVAL_DISPATCH = (
+    (vector_store.similarity_search, False),
+    (hyde_retriever.hyde_retrieve, False),
+    (vector_store.similarity_search, True),
+    (hyde_retriever.conditional_hyde_retrieve, True)
+)
+
+@lru_cache(maxsize=TOKEN_SET_CACHE_SIZE)
+def token_set(text: str) -> FrozenSet[str]:
+    """文本的小写词集合（带缓存，同一文档块在多次问答中只切分一次）"""
+    return frozenset(text.lower().split())
 
 class EnhancedRAGChain:
     """增强版RAG问答链条"""
     
     def __init__(self):
         """初始化增强版RAG链条"""
-        self.client = openai.OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_API_BASE
-        )
+        self.client = openai_client
         
         # 提示模板
         self.system_prompt = """你是一个专业的AI助手。请基于以下文档内容回答用户的问题。
@@ -37,8 +73,12 @@ class EnhancedRAGChain:
 用户问题：{question}
 
 请提供准确、有用的回答："""
+        
+        # 预先按占位符切分提示模板，每次请求只需拼接字符串
+        self._prompt_prefix, rest = self.system_prompt.split("{context}")
+        self._prompt_middle, self._prompt_suffix = rest.split("{question}")
     
-    def calculate_enhanced_confidence(self, source_docs, question, answer, retrieval_method="basic"):
+    def calculate_enhanced_confidence(self, source_docs, question, answer, method: RetrievalMethod = RetrievalMethod.BASIC):
         """增强的置信度计算"""
         if not source_docs:
             return 0.1
@@ -47,17 +87,19 @@ class EnhancedRAGChain:
         doc_score = min(len(source_docs) / settings.TOP_K, 1.0) * 0.3
         
         # 检索方法加分
-        method_bonus = 0.1 if retrieval_method == "hyde" else 0.0
+        method_bonus = 0.1 if method == RetrievalMethod.HYDE else 0.0
         
         # 相关性分数
         relevance_score = 0
-        question_words = set(question.lower().split())
+        question_words = token_set(question)
+        question_len = len(question_words)
         
         for doc in source_docs:
-            doc_words = set(doc.page_content.lower().split())
+            doc_words = token_set(doc.page_content)
             if question_words and doc_words:
-                overlap = len(question_words & doc_words) / len(question_words | doc_words)
-                relevance_score += overlap
+                # |A∪B| = |A| + |B| - |A∩B|，无需构造并集
+                intersection = len(question_words & doc_words)
+                relevance_score += intersection / (question_len + len(doc_words) - intersection)
         
         relevance_score = min(relevance_score / len(source_docs), 1.0) * 0.3 if source_docs else 0
         
@@ -65,122 +107,113 @@ class EnhancedRAGChain:
         answer_length_score = min(len(answer.split()) / 50, 1.0) * 0.2
         
         # 关键词匹配分数
-        keyword_score = 0
-        for word in question_words:
-            if len(word) > 2 and word in answer.lower():
-                keyword_score += 1
-        keyword_score = min(keyword_score / max(len(question_words), 1), 1.0) * 0.1
+        answer_lower = answer.lower()
+        keyword_score = sum(1 for word in question_words if len(word) > 2 and word in answer_lower)
+        keyword_score = min(keyword_score / max(question_len, 1), 1.0) * 0.1
         
         total_confidence = doc_score + relevance_score + answer_length_score + keyword_score + method_bonus
         
         return min(max(total_confidence, 0.1), 0.95)
     
-    def ask_basic(self, question: str) -> Dict:
-        """基础问答方法"""
-        print(f"🔵 使用基础检索方法")
-        start_time = time.time()
+    def _retrieve(self, question: str, method: RetrievalMethod, candidates: Dict = None) -> List[Tuple[Document, Optional[float]]]:
+        """按检索方法获取文档及重排序分数（无重排序时分数为None；candidates为预取的共享候选文档）"""
+        search, use_rerank = RETRIEVAL_DISPATCH[method]
+        k = settings.TOP_K * 2 if use_rerank else settings.TOP_K  # 重排序时检索更多候选文档
         
-        try:
-            # 1. 基础检索
-            source_docs = vector_store.similarity_search(question, k=settings.TOP_K)
-            
-            # 2. 构建上下文
-            context_parts = []
-            citations = []
-            
-            for i, doc in enumerate(source_docs):
-                context_parts.append(f"文档片段 {i+1}:\n{doc.page_content}")
-                citations.append({
-                    "chunk_id": i,
-                    "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                    "source": doc.metadata.get("source_file", "unknown"),
-                    "chunk_index": doc.metadata.get("chunk_id", i),
-                    "retrieval_method": "basic"
-                })
-            
-            context = "\n\n".join(context_parts)
-            
-            # 3. 生成答案
-            full_prompt = self.system_prompt.format(context=context, question=question)
-            
-            response = self.client.chat.completions.create(
-                model=settings.MODEL_NAME,
-                messages=[{"role": "user", "content": full_prompt}],
-                temperature=0.1,
-                max_tokens=1000
-            )
-            
-            answer = response.choices[0].message.content
-            response_time = time.time() - start_time
-            
-            # 4. 计算置信度
-            confidence = self.calculate_enhanced_confidence(source_docs, question, answer, "basic")
-            
-            tokens_used = response.usage.total_tokens if hasattr(response, 'usage') else None
-            
-            return {
-                "question": question,
-                "answer": answer,
-                "citations": citations,
-                "confidence": confidence,
-                "response_time": response_time,
-                "source_count": len(source_docs),
-                "tokens_used": tokens_used,
-                "retrieval_method": "basic"
-            }
-            
-        except Exception as e:
-            return {
-                "question": question,
-                "answer": f"抱歉，回答问题时出现错误：{str(e)}",
-                "citations": [],
-                "confidence": 0.0,
-                "response_time": time.time() - start_time,
-                "source_count": 0,
-                "tokens_used": 0,
-                "retrieval_method": "basic"
+        if candidates is not None:
+            docs = candidates[method][:k]
+        else:
+            docs = search(question, k=k)
+        
+        if not use_rerank:
+            return [(doc, None) for doc in docs]
+        return get_reranker().rerank(question, docs, top_k=settings.TOP_K)
+    
+    def _prefetch_candidates(self, question: str) -> Dict[RetrievalMethod, List[Document]]:
+        """为所有检索方法一次性预取候选文档：基础检索与HyDE检索各执行一次（k=TOP_K*2），各方法按需截取"""
+        k = settings.TOP_K * 2
+        
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            basic_future = executor.submit(vector_store.similarity_search_with_relevance, question, k)
+            hyde_future = executor.submit(hyde_retriever.hyde_retrieve, question, k)
+            basic_scored = basic_future.result()
+            hyde_docs = hyde_future.result()
+        
+        basic_docs = [doc for doc, score in basic_scored]
+        
+        # 增强模式与conditional_hyde_retrieve一致：基础检索足够相关时直接使用基础检索结果
+        basic_confident = bool(basic_scored) and basic_scored[0][1] >= settings.HYDE_TRIGGER_THRESHOLD
+        
+        return {
+            RetrievalMethod.BASIC: basic_docs,
+            RetrievalMethod.HYDE: hyde_docs,
+            RetrievalMethod.RERANK: basic_docs,
+            RetrievalMethod.ENHANCED: basic_docs if basic_confident else hyde_docs
+        }
+    
+    def _build_context(self, ranked_docs: List[Tuple[Document, Optional[float]]], retrieval_method: str) -> Tuple[str, List[Dict]]:
+        """构建上下文和引用信息（单次遍历，结果列表预分配）"""
+        n = len(ranked_docs)
+        context_parts = [None] * n
+        citations = [None] * n
+        
+        for i, (doc, score) in enumerate(ranked_docs):
+            content = doc.page_content
+            metadata = doc.metadata
+            # 排名靠后的片段只保留开头部分，减少提示词token
+            context_content = content if i < settings.CONTEXT_FULL_DOCS else truncate_tokens(content, settings.CONTEXT_TRUNCATE_TOKENS)
+            context_parts[i] = f"文档片段 {i+1}:\n{context_content}"
+            citation = {
+                "chunk_id": i,
+                "content": content[:200] + "..." if len(content) > 200 else content,
+                "source": metadata.get("source_file", "unknown"),
+                "chunk_index": int(metadata.get("chunk_id", i)),
+                "retrieval_method": retrieval_method
             }
+            if score is not None:
+                # 转为Python内置float（交叉编码器可能返回numpy.float32），保证orjson可直接序列化
+                citation["rerank_score"] = round(float(score), 3)
+            citations[i] = citation
+        
+        return "\n\n".join(context_parts), citations
     
-    def ask_hyde(self, question: str) -> Dict:
-        """使用HyDE检索的问答方法"""
-        print(f"中 使用HyDE检索方法")
+    def _completion_params(self, question: str, context: str) -> Dict:
+        """构建生成答案的请求参数"""
+        full_prompt = "".join((self._prompt_prefix, context, self._prompt_middle, question, self._prompt_suffix))
+        
+        return {
+            "model": settings.MODEL_NAME,
+            "messages": [{"role": "user", "content": full_prompt}],
+            "temperature": 0.1,
+            "max_tokens": 1000
+        }
+    
+    def _create_completion(self, question: str, context: str, stream: bool = False):
+        """调用LLM生成答案"""
+        return self.client.chat.completions.create(**self._completion_params(question, context), stream=stream)
+    
+    def _ask(self, question: str, method: str, candidates: Dict = None) -> Dict:
+        """执行完整问答流程：检索 -> 构建上下文 -> 生成答案 -> 置信度"""
+        method = RetrievalMethod[method.upper()]
+        retrieval_method = RETRIEVAL_METHOD_NAMES[method]
         start_time = time.time()
         
         try:
-            # 1. HyDE检索
-            source_docs = hyde_retriever.hyde_retrieve(question, k=settings.TOP_K)
+            # 1. 检索（含重排序）
+            ranked_docs = self._retrieve(question, method, candidates)
+            source_docs = [doc for doc, score in ranked_docs]
             
             # 2. 构建上下文
-            context_parts = []
-            citations = []
-            
-            for i, doc in enumerate(source_docs):
-                context_parts.append(f"文档片段 {i+1}:\n{doc.page_content}")
-                citations.append({
-                    "chunk_id": i,
-                    "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                    "source": doc.metadata.get("source_file", "unknown"),
-                    "chunk_index": doc.metadata.get("chunk_id", i),
-                    "retrieval_method": "hyde"
-                })
-            
-            context = "\n\n".join(context_parts)
+            context, citations = self._build_context(ranked_docs, retrieval_method)
             
             # 3. 生成答案
-            full_prompt = self.system_prompt.format(context=context, question=question)
-            
-            response = self.client.chat.completions.create(
-                model=settings.MODEL_NAME,
-                messages=[{"role": "user", "content": full_prompt}],
-                temperature=0.1,
-                max_tokens=1000
-            )
+            response = self._create_completion(question, context)
             
             answer = response.choices[0].message.content
             response_time = time.time() - start_time
             
             # 4. 计算置信度
-            confidence = self.calculate_enhanced_confidence(source_docs, question, answer, "hyde")
+            confidence = self.calculate_enhanced_confidence(source_docs, question, answer, method)
             
             tokens_used = response.usage.total_tokens if hasattr(response, 'usage') else None
             
@@ -192,182 +225,215 @@ class EnhancedRAGChain:
                 "response_time": response_time,
                 "source_count": len(source_docs),
                 "tokens_used": tokens_used,
-                "retrieval_method": "hyde"
+                "retrieval_method": retrieval_method
             }
             
         except Exception as e:
-            return {
-                "question": question,
-                "answer": f"抱歉，回答问题时出现错误：{str(e)}",
-                "citations": [],
-                "confidence": 0.0,
-                "response_time": time.time() - start_time,
-                "source_count": 0,
-                "tokens_used": 0,
-                "retrieval_method": "hyde"
-            }
+            return self._error_result(question, e, start_time, retrieval_method)
     
-    def ask_rerank(self, question: str) -> Dict:
-        """使用重排序的问答方法"""
+    def _error_result(self, question: str, error: Exception, start_time: float, retrieval_method: str) -> Dict:
+        """构建出错时的返回结果"""
+        return {
+            "question": question,
+            "answer": f"抱歉，回答问题时出现错误：{str(error)}",
+            "citations": [],
+            "confidence": 0.0,
+            "response_time": time.time() - start_time,
+            "source_count": 0,
+            "tokens_used": 0,
+            "retrieval_method": retrieval_method,
+            "error": True  # 出错结果不应被缓存复用
+        }
+    
+    def ask_basic(self, question: str, stream: bool = False, result: Dict = None) -> Union[Dict, Iterator[str]]:
+        """基础问答方法
+        
+        stream=False时返回结果字典；stream=True时返回逐段产出答案文本的生成器，
+        引用信息在第一段答案产出前写入result，生成结束后result中为完整结果（同ask_stream）
+        """
+        print(f"🔵 使用基础检索方法")
+        if stream:
+            return self.ask_stream(question, "basic", result)
+        return self._ask(question, "basic")
+    
+    def ask_hyde(self, question: str, stream: bool = False, result: Dict = None) -> Union[Dict, Iterator[str]]:
+        """使用HyDE检索的问答方法（参数与返回值同ask_basic）"""
+        print(f"中 使用HyDE检索方法")
+        if stream:
+            return self.ask_stream(question, "hyde", result)
+        return self._ask(question, "hyde")
+    
+    def ask_rerank(self, question: str, stream: bool = False, result: Dict = None) -> Union[Dict, Iterator[str]]:
+        """使用重排序的问答方法（参数与返回值同ask_basic）"""
         print(f"🟠 使用重排序方法")
+        if stream:
+            return self.ask_stream(question, "rerank", result)
+        return self._ask(question, "rerank")
+    
+    def ask_enhanced(self, question: str, stream: bool = False, result: Dict = None) -> Union[Dict, Iterator[str]]:
+        """使用HyDE+重排序的增强问答方法（参数与返回值同ask_basic）"""
+        print(f"高 使用HyDE+重排序增强方法")
+        if stream:
+            return self.ask_stream(question, "enhanced", result)
+        return self._ask(question, "enhanced")
+    
+    def ask_stream(self, question: str, method: str = "enhanced", result: Dict = None) -> Iterator[str]:
+        """流式问答：逐段产出答案文本
+        
+        引用信息（citations、source_count、retrieval_method）在第一段答案产出前写入result，
+        调用方可先行展示；生成结束后result中为与非流式调用相同的完整结果字典
+        """
+        method = RetrievalMethod[method.upper()]
+        retrieval_method = RETRIEVAL_METHOD_NAMES[method]
+        result = result if result is not None else {}
         start_time = time.time()
         
         try:
-            # 1. 检索更多文档
-            candidate_docs = vector_store.similarity_search(question, k=settings.TOP_K * 2)
-            
-            # 2. 重排序
-            ranked_docs = reranker.simple_rerank(question, candidate_docs, top_k=settings.TOP_K)
-            
-            # 3. 提取文档
+            # 1. 检索（含重排序）
+            ranked_docs = self._retrieve(question, method)
             source_docs = [doc for doc, score in ranked_docs]
             
-            # 4. 构建上下文
-            context_parts = []
-            citations = []
-            
-            for i, (doc, score) in enumerate(ranked_docs):
-                context_parts.append(f"文档片段 {i+1}:\n{doc.page_content}")
-                citations.append({
-                    "chunk_id": i,
-                    "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                    "source": doc.metadata.get("source_file", "unknown"),
-                    "chunk_index": doc.metadata.get("chunk_id", i),
-                    "retrieval_method": "rerank",
-                    "rerank_score": round(score, 3)
-                })
+            # 2. 构建上下文，引用信息在开始生成前即写入result，调用方可先行展示
+            context, citations = self._build_context(ranked_docs, retrieval_method)
+            result.update({"citations": citations, "source_count": len(source_docs), "retrieval_method": retrieval_method})
             
-            context = "\n\n".join(context_parts)
+            # 3. 流式生成答案
+            answer_parts = []
+            for chunk in self._create_completion(question, context, stream=True):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    answer_parts.append(delta)
+                    yield delta
             
-            # 5. 生成答案
-            full_prompt = self.system_prompt.format(context=context, question=question)
+            answer = "".join(answer_parts)
             
-            response = self.client.chat.completions.create(
-                model=settings.MODEL_NAME,
-                messages=[{"role": "user", "content": full_prompt}],
-                temperature=0.1,
-                max_tokens=1000
-            )
-            
-            answer = response.choices[0].message.content
-            response_time = time.time() - start_time
-            
-            # 6. 计算置信度
-            confidence = self.calculate_enhanced_confidence(source_docs, question, answer, "rerank")
-            
-            tokens_used = response.usage.total_tokens if hasattr(response, 'usage') else None
+            # 4. 计算置信度
+            confidence = self.calculate_enhanced_confidence(source_docs, question, answer, method)
             
-            return {
+            result.update({
                 "question": question,
                 "answer": answer,
                 "citations": citations,
                 "confidence": confidence,
-                "response_time": response_time,
+                "response_time": time.time() - start_time,
                 "source_count": len(source_docs),
-                "tokens_used": tokens_used,
-                "retrieval_method": "rerank"
-            }
+                "tokens_used": None,  # 流式响应不返回token用量
+                "retrieval_method": retrieval_method
+            })
             
         except Exception as e:
-            return {
-                "question": question,
-                "answer": f"抱歉，回答问题时出现错误：{str(e)}",
-                "citations": [],
-                "confidence": 0.0,
-                "response_time": time.time() - start_time,
-                "source_count": 0,
-                "tokens_used": 0,
-                "retrieval_method": "rerank"
-            }
+            result.update(self._error_result(question, e, start_time, retrieval_method))
+            yield result["answer"]
     
-    def ask_enhanced(self, question: str) -> Dict:
-        """使用HyDE+重排序的增强问答方法"""
-        print(f"高 使用HyDE+重排序增强方法")
+    def ask_batch(self, questions: List[str], method: str = "enhanced") -> List[Dict]:
+        """离线批量问答：检索完成后通过OpenAI Batch API一次提交所有生成请求（费用约为实时调用的一半，适合评测等非交互场景）"""
+        if not hasattr(self.client, "batches"):
+            raise RuntimeError(f"当前openai SDK（{openai.__version__}）不支持Batch API，请升级到 openai>={BATCH_API_MIN_OPENAI_VERSION}")
+        
+        method = RetrievalMethod[method.upper()]
+        retrieval_method = RETRIEVAL_METHOD_NAMES[method]
         start_time = time.time()
         
+        # 1. 并行检索并构建每个问题的上下文，单个问题检索失败只影响该问题的结果
+        def prepare(question):
+            try:
+                ranked_docs = self._retrieve(question, method)
+                context, citations = self._build_context(ranked_docs, retrieval_method)
+                return [doc for doc, score in ranked_docs], context, citations
+            except Exception as e:
+                return e
+        
+        with ThreadPoolExecutor(max_workers=BATCH_RETRIEVAL_WORKERS) as executor:
+            prepared = list(executor.map(prepare, questions))
+        
+        results = [
+            self._error_result(question, item, start_time, retrieval_method) if isinstance(item, Exception) else None
+            for question, item in zip(questions, prepared)
+        ]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        
         try:
-            # 1. HyDE检索获取候选文档
-            candidate_docs = hyde_retriever.hyde_retrieve(question, k=settings.TOP_K * 2)
-            
-            # 2. 重排序
-            ranked_docs = reranker.simple_rerank(question, candidate_docs, top_k=settings.TOP_K)
-            
-            # 3. 提取文档
-            source_docs = [doc for doc, score in ranked_docs]
-            
-            # 4. 构建上下文
-            context_parts = []
-            citations = []
-            
-            for i, (doc, score) in enumerate(ranked_docs):
-                context_parts.append(f"文档片段 {i+1}:\n{doc.page_content}")
-                citations.append({
-                    "chunk_id": i,
-                    "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                    "source": doc.metadata.get("source_file", "unknown"),
-                    "chunk_index": doc.metadata.get("chunk_id", i),
-                    "retrieval_method": "hyde+rerank",
-                    "rerank_score": round(score, 3)
+            # 2. 写入JSONL请求文件并提交批处理任务
+            lines = [
+                orjson.dumps({
+                    "custom_id": str(i),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": self._completion_params(questions[i], prepared[i][1])
                 })
-            
-            context = "\n\n".join(context_parts)
-            
-            # 5. 生成答案
-            full_prompt = self.system_prompt.format(context=context, question=question)
-            
-            response = self.client.chat.completions.create(
-                model=settings.MODEL_NAME,
-                messages=[{"role": "user", "content": full_prompt}],
-                temperature=0.1,
-                max_tokens=1000
+                for i in pending
+            ]
+            batch_file = self.client.files.create(file=("rag_batch.jsonl", b"\n".join(lines)), purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
             )
-            
-            answer = response.choices[0].message.content
-            response_time = time.time() - start_time
-            
-            # 6. 计算置信度
-            confidence = self.calculate_enhanced_confidence(source_docs, question, answer, "hyde+rerank")
-            
-            tokens_used = response.usage.total_tokens if hasattr(response, 'usage') else None
-            
-            return {
+            print(f"批处理任务已提交: {batch.id}，共 {len(pending)} 个问题")
+            
+            # 3. 轮询直到任务结束
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                time.sleep(BATCH_POLL_INTERVAL)
+                batch = self.client.batches.retrieve(batch.id)
+            
+            if batch.status != "completed" or not batch.output_file_id:
+                raise RuntimeError(f"批处理任务未完成，状态: {batch.status}")
+            
+            # 4. 按custom_id将结果分发回各个问题
+            responses = {}
+            for line in self.client.files.content(batch.output_file_id).text.splitlines():
+                if line.strip():
+                    record = orjson.loads(line)
+                    responses[record["custom_id"]] = record.get("response") or {}
+        except Exception as e:
+            print(f"批量问答失败: {e}")
+            for i in pending:
+                results[i] = self._error_result(questions[i], e, start_time, retrieval_method)
+            return results
+        
+        response_time = time.time() - start_time
+        for i in pending:
+            question = questions[i]
+            source_docs, _, citations = prepared[i]
+            body = responses.get(str(i), {}).get("body") or {}
+            if not body.get("choices"):
+                results[i] = self._error_result(question, RuntimeError("批处理结果缺失"), start_time, retrieval_method)
+                continue
+            
+            answer = body["choices"][0]["message"]["content"]
+            results[i] = {
                 "question": question,
                 "answer": answer,
                 "citations": citations,
-                "confidence": confidence,
+                "confidence": self.calculate_enhanced_confidence(source_docs, question, answer, method),
                 "response_time": response_time,
                 "source_count": len(source_docs),
-                "tokens_used": tokens_used,
-                "retrieval_method": "hyde+rerank"
-            }
-            
-        except Exception as e:
-            return {
-                "question": question,
-                "answer": f"抱歉，回答问题时出现错误：{str(e)}",
-                "citations": [],
-                "confidence": 0.0,
-                "response_time": time.time() - start_time,
-                "source_count": 0,
-                "tokens_used": 0,
-                "retrieval_method": "hyde+rerank"
+                "tokens_used": (body.get("usage") or {}).get("total_tokens"),
+                "retrieval_method": retrieval_method
             }
+        
+        return results
     
     def compare_methods(self, question: str) -> Dict:
         """比较不同检索方法的效果"""
         print(f"比较不同检索方法，问题: {question}")
         
-        methods = {
-            "basic": self.ask_basic,
-            "hyde": self.ask_hyde,
-            "rerank": self.ask_rerank,
-            "enhanced": self.ask_enhanced
-        }
+        methods = ["basic", "hyde", "rerank", "enhanced"]
+        
+        # 四种方法的候选文档高度重叠，只预取一次基础检索和一次HyDE检索供各方法共享
+        try:
+            candidates = self._prefetch_candidates(question)
+        except Exception as e:
+            # 预取失败时各方法自行检索，检索错误转为该方法的错误结果
+            print(f"候选文档预取失败，改为各方法分别检索: {e}")
+            candidates = None
         
-        results = {}
-        for method_name, method_func in methods.items():
-            print(f"\n--- 测试{method_name}方法 ---")
-            results[method_name] = method_func(question)
+        # 重排序与生成答案相互独立，耗时主要在等待API响应，并行执行使总耗时约等于最慢的方法
+        with ThreadPoolExecutor(max_workers=len(methods)) as executor:
+            futures = {method_name: executor.submit(self._ask, question, method_name, candidates) for method_name in methods}
+            results = {method_name: future.result() for method_name, future in futures.items()}
         
         return {
             "question": question,
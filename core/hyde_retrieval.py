@@ -2,20 +2,29 @@
 HyDE (Hypothetical Document Embeddings) 检索增强模块
 通过生成假设性答案来改善检索效果
 """
-import openai
+from core.openai_client import openai_client
 from core.vector_store_compatible import vector_store
+from core.simhash import document_simhash, is_near_duplicate
 from config.settings import settings
-from typing import List, Dict
+from typing import List, Dict, Tuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from langchain.schema import Document
 
+# HyQE入库时并发生成假设性问题的线程数
+HYQE_MAX_WORKERS = 8
+
+# 假设性答案最大token数（检索只需要关键词和语义信号，不需要长篇答案）
+HYPOTHETICAL_ANSWER_MAX_TOKENS = 150
+
+# 假设性答案缓存条目数（重复问题无需再次调用LLM）
+HYPOTHETICAL_ANSWER_CACHE_SIZE = 2048
+
 class HyDERetriever:
     """HyDE检索器"""
     
     def __init__(self):
-        self.client = openai.OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_API_BASE
-        )
+        self.client = openai_client
         
         # HyDE提示模板
         self.hyde_prompt = """请基于以下问题生成一个假设性的详细答案。这个答案将用于文档检索，所以请包含可能相关的关键词和概念。
@@ -23,66 +32,152 @@ class HyDERetriever:
 问题: {question}
 
 假设性答案:"""
+        
+        # HyQE提示模板（入库时为文档块生成问题）
+        self.hyqe_prompt = """请阅读以下文档内容，列出{n}个用户可能会提出、且能由该内容回答的问题。每行一个问题，不要编号，不要其他内容。
+
+文档内容:
+{content}
+
+问题:"""
     
     def generate_hypothetical_answer(self, question: str) -> str:
         """生成假设性答案"""
+        try:
+            # 去除首尾空白后作为缓存键，仅空白不同的相同问题共享缓存
+            return self._generate_hypothetical_answer_cached(settings.HYDE_MODEL_NAME, question.strip())
+        except Exception as e:
+            print(f"生成假设性答案失败: {e}")
+            return question  # fallback到原问题
+    
+    @lru_cache(maxsize=HYPOTHETICAL_ANSWER_CACHE_SIZE)
+    def _generate_hypothetical_answer_cached(self, model_name: str, question: str) -> str:
+        """按(模型, 问题)缓存假设性答案（调用失败时抛出异常，不会被缓存）"""
+        response = self.client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "user", "content": self.hyde_prompt.format(question=question)}
+            ],
+            temperature=0.3,
+            max_tokens=HYPOTHETICAL_ANSWER_MAX_TOKENS
+        )
+        return response.choices[0].message.content
+    
+    def generate_hypothetical_questions(self, content: str, n: int = None) -> List[str]:
+        """为文档块生成n个可能被提问的问题（HyQE入库阶段使用）"""
+        n = n or settings.HYQE_QUESTIONS_PER_CHUNK
         try:
             response = self.client.chat.completions.create(
-                model=settings.MODEL_NAME,
+                model=settings.HYDE_MODEL_NAME,
                 messages=[
-                    {"role": "user", "content": self.hyde_prompt.format(question=question)}
+                    {"role": "user", "content": self.hyqe_prompt.format(n=n, content=content)}
                 ],
                 temperature=0.3,
-                max_tokens=300
+                max_tokens=200
             )
-            return response.choices[0].message.content
+            lines = response.choices[0].message.content.splitlines()
+            return [line.strip().lstrip("0123456789.、)） -").strip() for line in lines if line.strip()][:n]
         except Exception as e:
-            print(f"生成假设性答案失败: {e}")
-            return question  # fallback到原问题
+            print(f"生成假设性问题失败: {e}")
+            return []
+    
+    def index_hypothetical_questions(self, chunks: List[Document]) -> int:
+        """为文档块预生成假设性问题并写入HyQE索引（未启用HYQE_ENABLED时跳过）"""
+        if not settings.HYQE_ENABLED or not chunks:
+            return 0
+        
+        print(f"🧩 为 {len(chunks)} 个文档块生成假设性问题...")
+        with ThreadPoolExecutor(max_workers=HYQE_MAX_WORKERS) as executor:
+            all_questions = list(executor.map(lambda chunk: self.generate_hypothetical_questions(chunk.page_content), chunks))
+        
+        # 每个问题的元数据中保存所属文档块的内容和元数据，命中问题即可还原文档块
+        question_docs = [
+            Document(page_content=q, metadata={**chunk.metadata, "parent_content": chunk.page_content})
+            for chunk, questions in zip(chunks, all_questions)
+            for q in questions
+        ]
+        if question_docs:
+            vector_store.add_hypothetical_questions(question_docs)
+        
+        print(f"HyQE索引完成，共 {len(question_docs)} 个假设性问题")
+        return len(question_docs)
+    
+    def hyqe_retrieve(self, question: str, k: int) -> List[Document]:
+        """用原问题直接匹配预生成的假设性问题，返回去重后的所属文档块"""
+        matches = vector_store.hypothetical_question_search(question, k=k * settings.HYQE_QUESTIONS_PER_CHUNK)
+        
+        results = []
+        seen_content = set()
+        for match in matches:
+            metadata = dict(match.metadata)
+            content = metadata.pop("parent_content", None)
+            if content is None or content in seen_content:
+                continue
+            seen_content.add(content)
+            results.append(Document(page_content=content, metadata=metadata))
+            if len(results) >= k:
+                break
+        
+        return results
     
     def hyde_retrieve(self, question: str, k: int = None) -> List[Document]:
-        """使用HyDE方法检索文档"""
+        """使用HyDE方法检索文档（启用HyQE时优先查询假设性问题索引，不调用LLM）"""
         k = k or settings.TOP_K
         
+        if settings.HYQE_ENABLED:
+            hyqe_results = self.hyqe_retrieve(question, k)
+            if hyqe_results:
+                print(f"HyQE检索完成，返回 {len(hyqe_results)} 个文档")
+                return hyqe_results
+            print("HyQE索引未命中，回退到HyDE检索")
+        
+        unique_results, _, _ = self._hyde_retrieve_detailed(question, k)
+        return unique_results
+    
+    def conditional_hyde_retrieve(self, question: str, k: int = None) -> List[Document]:
+        """条件HyDE：基础检索的最高相关性达到阈值时直接使用基础检索结果，否则再进行HyDE检索"""
+        k = k or settings.TOP_K
+        
+        basic_results = vector_store.similarity_search_with_relevance(question, k=k)
+        if basic_results and basic_results[0][1] >= settings.HYDE_TRIGGER_THRESHOLD:
+            print(f"基础检索相关性 {basic_results[0][1]:.3f} 已达阈值，跳过HyDE")
+            return [doc for doc, score in basic_results]
+        
+        return self.hyde_retrieve(question, k)
+    
+    def _hyde_retrieve_detailed(self, question: str, k: int) -> Tuple[List[Document], str, List[Document]]:
+        """HyDE检索，返回 (去重结果, 假设性答案, 原问题检索结果)"""
         print(f"🔍 使用HyDE增强检索...")
         
         # 1. 生成假设性答案（后台处理，不显示给用户）
         hypothetical_answer = self.generate_hypothetical_answer(question)
         
-        # 2. 使用假设性答案进行检索
-        hyde_results = vector_store.similarity_search(hypothetical_answer, k=k*2)
-        
-        # 3. 同时使用原问题检索
-        question_results = vector_store.similarity_search(question, k=k)
+        # 2. 假设性答案与原问题合并为一次批量检索（一次向量化请求 + 一次索引查询）
+        hyde_results, question_results = vector_store.similarity_search_batch([hypothetical_answer, question], k=k*2)
+        question_results = question_results[:k]
         
-        # 4. 合并和去重结果
+        # 3. 合并和去重结果（SimHash近似去重，重叠窗口、空白差异的块也会被合并）
         all_results = hyde_results + question_results
         unique_results = []
-        seen_content = set()
+        seen_fingerprints = []
         
         for doc in all_results:
-            content_hash = hash(doc.page_content)
-            if content_hash not in seen_content:
-                seen_content.add(content_hash)
+            fingerprint = document_simhash(doc)
+            if not is_near_duplicate(fingerprint, seen_fingerprints):
+                seen_fingerprints.append(fingerprint)
                 unique_results.append(doc)
                 if len(unique_results) >= k:
                     break
         
         print(f"HyDE检索完成，返回 {len(unique_results)} 个文档")
-        return unique_results[:k]
+        return unique_results[:k], hypothetical_answer, question_results
     
     def compare_retrieval_methods(self, question: str, k: int = 5) -> Dict:
         """比较不同检索方法的效果"""
         print(f"比较检索方法，问题: {question}")
         
-        # 基础检索
-        basic_results = vector_store.similarity_search(question, k=k)
-        
-        # HyDE检索
-        hyde_results = self.hyde_retrieve(question, k=k)
-        
-        # 生成假设性答案
-        hypothetical_answer = self.generate_hypothetical_answer(question)
+        # HyDE检索过程中的原问题检索即为基础检索，假设性答案也直接复用
+        hyde_results, hypothetical_answer, basic_results = self._hyde_retrieve_detailed(question, k)
         
         return {
             "question": question,
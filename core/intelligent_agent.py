@@ -2,17 +2,69 @@
 智能Agent核心模块
 实现工具调用、决策制定和任务执行
 """
-import openai
-from typing import Dict, List, Any, Optional
+from core.openai_client import openai_client
+from typing import Dict, Iterator, List, Any, Optional
 from config.settings import settings
-import json
+from functools import lru_cache
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+import ast
+import orjson
 import re
+import threading
+
+# 并发执行工具调用的最大线程数
+MAX_TOOL_WORKERS = 4
+
+# 从文本中提取数学表达式的正则
+MATH_EXPRESSION_PATTERN = re.compile(r'[\d+\-*/().]+')
+
+# 计算器允许的字符（translate删除这些字符后仍有剩余即包含非法字符）
+CALCULATOR_CHAR_FILTER = str.maketrans('', '', '0123456789+-*/%.() ')
+
+# 计算器允许的语法节点（仅数字常量和算术运算）
+CALCULATOR_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.USub, ast.UAdd
+)
+
+# 幂运算指数绝对值上限（防止 9**9**9 之类的表达式长时间占用线程）
+CALCULATOR_MAX_EXPONENT = 100
+
+def _check_power(node: ast.BinOp):
+    """幂运算只允许绝对值不超过上限的数字常量指数，且底数中不能再嵌套幂运算"""
+    exponent = node.right
+    if isinstance(exponent, ast.UnaryOp) and isinstance(exponent.op, (ast.USub, ast.UAdd)):
+        exponent = exponent.operand
+    if not isinstance(exponent, ast.Constant) or abs(exponent.value) > CALCULATOR_MAX_EXPONENT:
+        raise ValueError(f"不安全的表达式: 指数必须是绝对值不超过{CALCULATOR_MAX_EXPONENT}的数字")
+    if any(isinstance(child, ast.BinOp) and isinstance(child.op, ast.Pow) for child in ast.walk(node.left)):
+        raise ValueError("不安全的表达式: 不支持嵌套幂运算")
+
+@lru_cache(maxsize=1024)
+def compile_expression(expression: str):
+    """解析并校验数学表达式，返回编译后的代码对象（相同表达式只编译一次）"""
+    tree = ast.parse(expression.strip(), mode="eval")
+    for node in ast.walk(tree):
+        if not isinstance(node, CALCULATOR_ALLOWED_NODES):
+            raise ValueError(f"不安全的表达式: {type(node).__name__}")
+        if isinstance(node, ast.Constant) and (isinstance(node.value, bool) or not isinstance(node.value, (int, float))):
+            raise ValueError("不安全的表达式: 仅支持数字")
+    # 常量类型校验完成后再检查幂运算（保证指数比较的是数字）
+    for node in ast.walk(tree):
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+            _check_power(node)
+    return compile(tree, "<calculator>", "eval")
 
 class ToolRegistry:
     """工具注册表"""
     
     def __init__(self):
         self.tools = {}
+        # 工具定义缓存，注册新工具时递增版本号使旧缓存失效
+        self._revision = 0
+        self._definitions_cache = {}
         self._register_default_tools()
     
     def _register_default_tools(self):
@@ -71,34 +123,30 @@ class ToolRegistry:
             },
             "function": function
         }
+        self._revision += 1
+        self._definitions_cache.clear()
     
     def get_tool_definitions(self, selected_tools: List[str] = None) -> List[Dict]:
-        """获取工具定义"""
-        if selected_tools:
-            return [
-                {
-                    "type": "function",
-                    "function": {
-                        "name": tool_name,
-                        "description": tool_info["description"],
-                        "parameters": tool_info["parameters"]
-                    }
-                }
-                for tool_name, tool_info in self.tools.items()
-                if tool_name in selected_tools
-            ]
-        else:
-            return [
-                {
-                    "type": "function", 
-                    "function": {
-                        "name": tool_name,
-                        "description": tool_info["description"],
-                        "parameters": tool_info["parameters"]
-                    }
+        """获取工具定义（按注册版本和所选工具缓存）"""
+        key = (self._revision, frozenset(selected_tools) if selected_tools else None)
+        cached = self._definitions_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        definitions = [
+            {
+                "type": "function",
+                "function": {
+                    "name": tool_name,
+                    "description": tool_info["description"],
+                    "parameters": tool_info["parameters"]
                 }
-                for tool_name, tool_info in self.tools.items()
-            ]
+            }
+            for tool_name, tool_info in self.tools.items()
+            if not selected_tools or tool_name in selected_tools
+        ]
+        self._definitions_cache[key] = definitions
+        return definitions
     
     def execute_tool(self, tool_name: str, parameters: Dict) -> Dict[str, Any]:
         """执行工具"""
@@ -127,17 +175,20 @@ class ToolRegistry:
     def _calculator(self, expression: str) -> Dict[str, Any]:
         """计算器实现"""
         try:
-            # 安全的数学计算
-            allowed_chars = set('0123456789+-*/.() ')
-            if all(c in allowed_chars for c in expression):
-                result = eval(expression)
-                return {
-                    "calculation": expression,
-                    "result": result,
-                    "success": True
-                }
-            else:
+            # 安全的数学计算（先做字符白名单快速过滤，再做AST白名单校验，编译结果带缓存）
+            if expression.translate(CALCULATOR_CHAR_FILTER):
+                return {"error": "不安全的表达式"}
+            try:
+                code = compile_expression(expression)
+            except (SyntaxError, ValueError):
                 return {"error": "不安全的表达式"}
+            
+            result = eval(code, {"__builtins__": {}}, {})
+            return {
+                "calculation": expression,
+                "result": result,
+                "success": True
+            }
         except Exception as e:
             return {"error": f"计算失败: {str(e)}"}
     
@@ -164,13 +215,19 @@ class ToolRegistry:
 class IntelligentAgent:
     """智能Agent"""
     
+    # 界面工具名称到注册工具名称的映射
+    TOOL_MAPPING = MappingProxyType({
+        "knowledge_base": "knowledge_base_search",
+        "calculator": "calculator",
+        "search_engine": "search_engine",
+        "file_analysis": "file_analyzer"
+    })
+    
     def __init__(self):
-        self.client = openai.OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_API_BASE
-        )
+        self.client = openai_client
         self.tool_registry = ToolRegistry()
         self.conversation_history = []
+        self._tool_descriptions_cache = {}
     
     def process_request(self, user_input: str, selected_tools: List[str] = None, 
                        agent_enabled: bool = True) -> Dict[str, Any]:
@@ -229,18 +286,22 @@ class IntelligentAgent:
             message = response.choices[0].message
             
             if message.tool_calls:
-                # 执行工具调用
-                tool_results = []
-                for tool_call in message.tool_calls:
-                    tool_name = tool_call.function.name
-                    tool_args = json.loads(tool_call.function.arguments)
-                    
-                    result = self.tool_registry.execute_tool(tool_name, tool_args)
-                    tool_results.append({
-                        "tool": tool_name,
-                        "args": tool_args,
-                        "result": result
-                    })
+                # 执行工具调用（多个工具调用互相独立，并发执行，结果保持原顺序）
+                calls = [
+                    (tool_call.function.name, orjson.loads(tool_call.function.arguments))
+                    for tool_call in message.tool_calls
+                ]
+                
+                if len(calls) > 1:
+                    with ThreadPoolExecutor(max_workers=min(len(calls), MAX_TOOL_WORKERS)) as executor:
+                        results = list(executor.map(lambda call: self.tool_registry.execute_tool(*call), calls))
+                else:
+                    results = [self.tool_registry.execute_tool(*calls[0])]
+                
+                tool_results = [
+                    {"tool": tool_name, "args": tool_args, "result": result}
+                    for (tool_name, tool_args), result in zip(calls, results)
+                ]
                 
                 # 生成最终回答
                 return self._generate_final_answer(user_input, tool_results)
@@ -265,14 +326,7 @@ class IntelligentAgent:
     def _direct_tool_process(self, user_input: str, tool_name: str) -> Dict[str, Any]:
         """直接工具处理"""
         # 映射工具名称
-        tool_mapping = {
-            "knowledge_base": "knowledge_base_search",
-            "calculator": "calculator",
-            "search_engine": "search_engine",
-            "file_analysis": "file_analyzer"
-        }
-        
-        actual_tool_name = tool_mapping.get(tool_name, tool_name)
+        actual_tool_name = self.TOOL_MAPPING.get(tool_name, tool_name)
         
         # 准备参数
         if actual_tool_name == "knowledge_base_search":
@@ -302,7 +356,7 @@ class IntelligentAgent:
                 }
             else:
                 return {
-                    "answer": f"工具执行结果：{json.dumps(tool_result, ensure_ascii=False)}",
+                    "answer": f"工具执行结果：{orjson.dumps(tool_result).decode()}",
                     "confidence": 0.7,
                     "citations": [],
                     "tool_calls": [{"tool": actual_tool_name, "result": tool_result}]
@@ -342,30 +396,65 @@ class IntelligentAgent:
                 "tool_calls": []
             }
     
+    def normal_chat_stream(self, user_input: str, result: Dict = None) -> Iterator[str]:
+        """流式普通对话：逐段产出回答文本，结束后将完整结果写入result字典"""
+        result = result if result is not None else {}
+        try:
+            stream = self.client.chat.completions.create(
+                model=settings.MODEL_NAME,
+                messages=[
+                    {"role": "system", "content": "你是一个有用的AI助手，请尽力回答用户的问题。"},
+                    {"role": "user", "content": user_input}
+                ],
+                temperature=0.7,
+                stream=True
+            )
+            
+            answer_parts = []
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    answer_parts.append(delta)
+                    yield delta
+            
+            result.update({
+                "answer": "".join(answer_parts),
+                "confidence": 0.7,
+                "citations": [],
+                "tool_calls": []
+            })
+        
+        except Exception as e:
+            result.update({
+                "answer": f"普通对话处理失败: {str(e)}",
+                "confidence": 0.0,
+                "citations": [],
+                "tool_calls": []
+            })
+            yield result["answer"]
+    
     def _format_tool_descriptions(self, selected_tools: List[str]) -> str:
-        """格式化工具描述"""
-        tool_mapping = {
-            "knowledge_base": "knowledge_base_search",
-            "calculator": "calculator", 
-            "search_engine": "search_engine",
-            "file_analysis": "file_analyzer"
-        }
+        """格式化工具描述（工具注册后不再变化，按所选工具缓存结果）"""
+        key = tuple(selected_tools)
+        cached = self._tool_descriptions_cache.get(key)
+        if cached is not None:
+            return cached
         
         descriptions = []
         for tool in selected_tools:
-            actual_tool = tool_mapping.get(tool, tool)
+            actual_tool = self.TOOL_MAPPING.get(tool, tool)
             if actual_tool in self.tool_registry.tools:
                 tool_info = self.tool_registry.tools[actual_tool]
                 descriptions.append(f"- {tool_info['name']}: {tool_info['description']}")
         
-        return "\n".join(descriptions)
+        result = "\n".join(descriptions)
+        self._tool_descriptions_cache[key] = result
+        return result
     
     def _extract_math_expression(self, text: str) -> str:
         """提取数学表达式"""
         # 简单的数学表达式提取
-        import re
-        pattern = r'[\d+\-*/().]+' 
-        matches = re.findall(pattern, text)
+        matches = MATH_EXPRESSION_PATTERN.findall(text)
         return matches[0] if matches else text
     
     def _generate_final_answer(self, user_input: str, tool_results: List[Dict]) -> Dict[str, Any]:
@@ -399,5 +488,21 @@ class IntelligentAgent:
             "tool_calls": tool_results
         }
 
-# 全局Agent实例
-intelligent_agent = IntelligentAgent()
+# 全局Agent实例（首次使用时创建，导入模块不产生初始化开销）
+_intelligent_agent = None
+_intelligent_agent_lock = threading.Lock()
+
+def get_intelligent_agent() -> IntelligentAgent:
+    """获取全局Agent实例（双重检查加锁，并发首次调用时只创建一个实例）"""
+    global _intelligent_agent
+    if _intelligent_agent is None:
+        with _intelligent_agent_lock:
+            if _intelligent_agent is None:
+                _intelligent_agent = IntelligentAgent()
+    return _intelligent_agent
+
+def __getattr__(name: str):
+    """兼容 from ... import intelligent_agent 的写法"""
+    if name == "intelligent_agent":
+        return get_intelligent_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,35 @@
+"""
+共享OpenAI客户端
+所有模块复用同一个HTTP连接池，避免各自建立连接和TLS握手
+"""
+import importlib.util
+import httpx
+import openai
+from config.settings import settings
+
+# 连接池上限（compare_methods、批量评测等场景会并发请求）
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+
+def create_http_client() -> httpx.Client:
+    """创建带连接池的HTTP客户端（安装了h2时启用HTTP/2多路复用）"""
+    return httpx.Client(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS
+        ),
+        timeout=httpx.Timeout(60.0, connect=10.0)
+    )
+
+def create_openai_client(http_client: httpx.Client = None) -> openai.OpenAI:
+    """创建OpenAI客户端（默认使用共享连接池）"""
+    return openai.OpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        base_url=settings.OPENAI_API_BASE,
+        http_client=http_client or shared_http_client
+    )
+
+# 创建全局共享的HTTP连接池和OpenAI客户端实例
+shared_http_client = create_http_client()
+openai_client = create_openai_client()
@@ -1,9 +1,12 @@
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
+from core.openai_client import shared_http_client
 from core.vector_store_compatible import vector_store
+from core.response_cache import SemanticResponseCache
 from config.settings import settings
 from typing import Dict, List
+import threading
 import time
 import json
 
@@ -16,6 +19,7 @@ class RAGChain:
         self.llm = ChatOpenAI(
             api_key=settings.OPENAI_API_KEY,
             base_url=settings.OPENAI_API_BASE,
+            http_client=shared_http_client,  # 复用共享连接池
             model_name=settings.MODEL_NAME,
             temperature=0.1  # 较低的温度确保回答更准确
         )
@@ -46,6 +50,10 @@ class RAGChain:
             """
         )
         
+        # 语义响应缓存（温度0.1，回答稳定）
+        self.cache = SemanticResponseCache(max_entries=1000, ttl=1800, sim_threshold=0.93)
+        vector_store.register_dependent_cache(self.cache)  # 知识库更新后缓存的回答失效
+        
         # 创建检索问答链
         self.qa_chain = RetrievalQA.from_chain_type(
             llm=self.llm,
@@ -61,6 +69,14 @@ class RAGChain:
         
         start_time = time.time()
         
+        try:
+            cached = self.cache.lookup(question)
+        except Exception as e:
+            print(f" 语义缓存查询失败: {e}")
+            cached = None
+        if cached is not None:
+            return {**cached, "question": question, "response_time": time.time() - start_time, "cache": "semantic_hit"}
+        
         try:
             # 执行问答
             result = self.qa_chain({"query": question})
@@ -73,14 +89,15 @@ class RAGChain:
             source_docs = result["source_documents"]
             
             # 构建引用信息
-            citations = []
+            citations = [None] * len(source_docs)
             for i, doc in enumerate(source_docs):
-                citations.append({
+                content = doc.page_content
+                citations[i] = {
                     "chunk_id": i,
-                    "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
+                    "content": content[:200] + "..." if len(content) > 200 else content,
                     "source": doc.metadata.get("source_file", "unknown"),
                     "chunk_index": doc.metadata.get("chunk_id", i)
-                })
+                }
             
             # 简单的置信度计算（基于检索到的文档数量和相关性）
             confidence = min(0.9, len(source_docs) / settings.TOP_K * 0.8 + 0.1)
@@ -97,6 +114,11 @@ class RAGChain:
             print(f" 回答生成完成，耗时 {response_time:.2f} 秒")
             print(f" 使用了 {len(source_docs)} 个文档片段")
             
+            try:
+                self.cache.insert(question, result_dict)
+            except Exception as e:
+                print(f" 语义缓存写入失败: {e}")
+            
             return result_dict
             
         except Exception as e:
@@ -110,5 +132,21 @@ class RAGChain:
                 "source_count": 0
             }
 
-# 创建全局RAG链条实例
-rag_chain = RAGChain()
\ No newline at end of file
+# 全局RAG链条实例（首次使用时创建，导入模块不产生初始化开销）
+_rag_chain = None
+_rag_chain_lock = threading.Lock()
+
+def get_rag_chain() -> RAGChain:
+    """获取全局RAG链条实例（双重检查加锁，并发首次调用时只创建一个实例）"""
+    global _rag_chain
+    if _rag_chain is None:
+        with _rag_chain_lock:
+            if _rag_chain is None:
+                _rag_chain = RAGChain()
+    return _rag_chain
+
+def __getattr__(name: str):
+    """兼容 from ... import rag_chain 的写法"""
+    if name == "rag_chain":
+        return get_rag_chain()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,30 +1,59 @@
-import openai
+from core.openai_client import openai_client
 from core.vector_store_compatible import vector_store
+from core.response_cache import SemanticResponseCache
+from core.token_utils import count_tokens
 from config.settings import settings
-from typing import Dict, List
+from typing import Dict, Iterator, List, FrozenSet
+from functools import lru_cache
+import io
+import threading
 import time
 import json
+import re
+
+# 温度高于该值时回答随机性较大，不使用语义缓存
+CACHEABLE_MAX_TEMPERATURE = 0.2
+
+# 文档词集合缓存上限
+TOKEN_SET_CACHE_SIZE = 4096
+
+# CAG模式回答中的片段引用标记
+CITATION_MARKER_PATTERN = re.compile(r'片段\s*(\d+)')
+
+@lru_cache(maxsize=TOKEN_SET_CACHE_SIZE)
+def token_set(text: str) -> FrozenSet[str]:
+    """文本的小写词集合（带缓存，同一文档块在多次问答中只切分一次）"""
+    return frozenset(text.lower().split())
 
 class SimpleRAGChain:
     """简化的RAG问答链条"""
     
     def __init__(self):
         """初始化RAG链条"""
-        self.client = openai.OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_API_BASE
-        )
+        self.client = openai_client
+        self.temperature = 0.1
         
-        # 提示模板
-        self.system_prompt = """你是一个专业的AI助手。请基于以下文档内容回答用户的问题。
+        # 语义响应缓存（仅在低温度、回答稳定时启用）
+        self.cache = SemanticResponseCache(max_entries=1000, ttl=1800, sim_threshold=0.93)
+        vector_store.register_dependent_cache(self.cache)  # 知识库更新后缓存的回答失效
+        
+        # 系统提示只包含固定指令，不做任何插值，保证每次请求的前缀字节一致以命中服务端前缀缓存
+        self.system_prompt = """你是一个专业的AI助手。请基于用户提供的文档内容回答用户的问题。
 
 请遵循以下要求：
 1. 只基于提供的文档内容回答，不要编造信息
 2. 如果文档中没有相关信息，请明确说明
 3. 回答要简洁明了，突出重点
-4. 可以适当引用文档中的原文
-
-相关文档内容：
+4. 可以适当引用文档中的原文"""
+        
+        # CAG模式：知识库足够小时把全部文档块放入系统提示，按文档块数量变化重建
+        self.mode = "rag"
+        self._cag_docs = []
+        self._cag_system_prompt = None
+        self._cag_doc_count = -1
+        
+        # 用户消息模板（动态的上下文和问题）
+        self.user_template = """相关文档内容：
 {context}
 
 用户问题：{question}
@@ -41,14 +70,15 @@ class SimpleRAGChain:
         
         # 2. 相关性分数：基于文档内容与问题的匹配度
         relevance_score = 0
-        question_words = set(question.lower().split())
+        question_words = token_set(question)
+        question_len = len(question_words)
         
         for doc in source_docs:
-            doc_words = set(doc.page_content.lower().split())
-            # 计算词汇重叠度
+            doc_words = token_set(doc.page_content)
+            # 计算词汇重叠度（|A∪B| = |A| + |B| - |A∩B|，无需构造并集）
             if question_words and doc_words:
-                overlap = len(question_words & doc_words) / len(question_words | doc_words)
-                relevance_score += overlap
+                intersection = len(question_words & doc_words)
+                relevance_score += intersection / (question_len + len(doc_words) - intersection)
         
         relevance_score = min(relevance_score / len(source_docs), 1.0) * 0.3 if source_docs else 0
         
@@ -56,102 +86,255 @@ class SimpleRAGChain:
         answer_length_score = min(len(answer.split()) / 50, 1.0) * 0.2
         
         # 4. 关键词匹配分数：答案是否包含问题中的关键词
-        keyword_score = 0
-        for word in question_words:
-            if len(word) > 2 and word in answer.lower():
-                keyword_score += 1
-        keyword_score = min(keyword_score / max(len(question_words), 1), 1.0) * 0.1
+        answer_lower = answer.lower()
+        keyword_score = sum(1 for word in question_words if len(word) > 2 and word in answer_lower)
+        keyword_score = min(keyword_score / max(question_len, 1), 1.0) * 0.1
         
         total_confidence = doc_score + relevance_score + answer_length_score + keyword_score
         
         return min(max(total_confidence, 0.1), 0.95)  # 限制在0.1-0.95之间
     
-    def ask(self, question: str) -> Dict:
-        """提问并获取答案"""
-        print(f"🤔 用户问题: {question}")
-        
-        start_time = time.time()
+    def _refresh_cag(self):
+        """知识库规模变化时重建CAG系统提示，总token数超过CAG_MAX_TOKENS时回退到RAG模式"""
+        if settings.CAG_MAX_TOKENS <= 0:
+            self.mode = "rag"
+            return
         
         try:
-            # 1. 检索相关文档
-            print("正在检索相关文档...")
-            source_docs = vector_store.similarity_search(question, k=settings.TOP_K)
+            doc_count = vector_store.count()
+            if doc_count == self._cag_doc_count:
+                return
+            self._cag_doc_count = doc_count
             
-            # 2. 构建上下文
-            context_parts = []
-            citations = []
+            docs = vector_store.get_all_documents() if doc_count else []
+            docs.sort(key=lambda doc: (doc.metadata.get("source_file", ""), doc.metadata.get("chunk_id", 0)))
             
-            for i, doc in enumerate(source_docs):
-                context_parts.append(f"文档片段 {i+1}:\n{doc.page_content}")
-                
-                citations.append({
-                    "chunk_id": i,
-                    "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                    "source": doc.metadata.get("source_file", "unknown"),
-                    "chunk_index": doc.metadata.get("chunk_id", i)
-                })
+            parts = []
+            total_tokens = 0
+            for i, doc in enumerate(docs, 1):
+                part = f"[片段{i}] 来源: {doc.metadata.get('source_file', 'unknown')}\n{doc.page_content}"
+                total_tokens += count_tokens(part)
+                if total_tokens > settings.CAG_MAX_TOKENS:
+                    break
+                parts.append(part)
             
-            context = "\n\n".join(context_parts)
+            if not docs or len(parts) < len(docs):
+                self.mode = "rag"
+                self._cag_docs = []
+                self._cag_system_prompt = None
+                print(f"知识库 {doc_count} 个文档块，使用RAG模式")
+                return
             
-            # 3. 构建完整提示
-            full_prompt = self.system_prompt.format(
-                context=context,
-                question=question
+            self.mode = "cag"
+            self._cag_docs = docs
+            self._cag_system_prompt = (
+                self.system_prompt
+                + "\n5. 引用文档内容时请标注片段编号，如[片段1]\n\n全部文档内容：\n"
+                + "\n\n".join(parts)
             )
+            print(f"知识库 {doc_count} 个文档块（约 {total_tokens} tokens），使用CAG模式")
+        except Exception as e:
+            print(f"CAG初始化失败，使用RAG模式: {e}")
+            self.mode = "rag"
+    
+    def _cag_cited_docs(self, answer: str) -> List:
+        """从回答中解析引用的片段编号，返回对应的文档块"""
+        cited = []
+        for number in dict.fromkeys(CITATION_MARKER_PATTERN.findall(answer)):
+            index = int(number) - 1
+            if 0 <= index < len(self._cag_docs):
+                cited.append(self._cag_docs[index])
+        return cited
+    
+    def _lookup_cache(self, question: str):
+        """查询语义缓存（缓存出错时视为未命中）"""
+        if self.temperature > CACHEABLE_MAX_TEMPERATURE:
+            return None
+        try:
+            return self.cache.lookup(question)
+        except Exception as e:
+            print(f"语义缓存查询失败: {e}")
+            return None
+    
+    def _insert_cache(self, question: str, result_dict: Dict):
+        """写入语义缓存"""
+        if self.temperature > CACHEABLE_MAX_TEMPERATURE:
+            return
+        try:
+            self.cache.insert(question, result_dict)
+        except Exception as e:
+            print(f"语义缓存写入失败: {e}")
+    
+    def _citation(self, doc, index: int) -> Dict:
+        """构建引用信息"""
+        content = doc.page_content
+        return {
+            "chunk_id": index,
+            "content": content[:200] + "..." if len(content) > 200 else content,
+            "source": doc.metadata.get("source_file", "unknown"),
+            "chunk_index": doc.metadata.get("chunk_id", index)
+        }
+    
+    def _prepare_messages(self, question: str):
+        """检索文档并构建消息，返回 (消息列表, 文档块, 引用)；CAG模式下文档块和引用在生成后确定，返回None"""
+        self._refresh_cag()
+        
+        if self.mode == "cag":
+            # 1-3. CAG模式：全部文档已在固定的系统提示中，无需检索
+            print("使用CAG模式，跳过检索")
+            messages = [
+                {"role": "system", "content": self._cag_system_prompt},
+                {"role": "user", "content": question}
+            ]
+            return messages, None, None
+        
+        # 1. 检索相关文档
+        print("正在检索相关文档...")
+        source_docs = vector_store.similarity_search(question, k=settings.TOP_K)
+        
+        # 2. 构建上下文（一次遍历同时写入上下文缓冲区和预分配的引用列表）
+        context_buffer = io.StringIO()
+        citations = [None] * len(source_docs)
+        
+        for i, doc in enumerate(source_docs):
+            if i:
+                context_buffer.write("\n\n")
+            context_buffer.write(f"文档片段 {i+1}:\n")
+            context_buffer.write(doc.page_content)
             
-            print(f"构建上下文完成，使用了 {len(source_docs)} 个文档片段")
+            citations[i] = self._citation(doc, i)
+        
+        context = context_buffer.getvalue()
+        
+        # 3. 构建用户消息
+        user_prompt = self.user_template.format(
+            context=context,
+            question=question
+        )
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        
+        print(f"构建上下文完成，使用了 {len(source_docs)} 个文档片段")
+        return messages, source_docs, citations
+    
+    def _build_result(self, question: str, answer: str, source_docs, citations, start_time: float, tokens_used) -> Dict:
+        """根据生成的答案构建结果字典"""
+        if source_docs is None:
+            # CAG模式：引用回答中标注的片段
+            source_docs = self._cag_cited_docs(answer)
+            citations = [self._citation(doc, i) for i, doc in enumerate(source_docs)]
+        
+        # 5. 计算响应时间
+        response_time = time.time() - start_time
+        
+        # 6. 计算置信度
+        confidence = self.calculate_confidence(source_docs, question, answer)
+        
+        result_dict = {
+            "question": question,
+            "answer": answer,
+            "citations": citations,
+            "confidence": confidence,
+            "response_time": response_time,
+            "source_count": len(source_docs),
+            "tokens_used": tokens_used
+        }
+        
+        print(f"回答生成完成")
+        print(f"总耗时: {response_time:.2f} 秒")
+        print(f"使用了 {len(source_docs)} 个文档片段")
+        if tokens_used:
+            print(f"消耗 tokens: {tokens_used}")
+        
+        self._insert_cache(question, result_dict)
+        return result_dict
+    
+    def _error_result(self, question: str, error: Exception, start_time: float) -> Dict:
+        """问答失败时的结果字典"""
+        print(f"问答失败: {error}")
+        return {
+            "question": question,
+            "answer": f"抱歉，回答问题时出现错误：{str(error)}",
+            "citations": [],
+            "confidence": 0.0,
+            "response_time": time.time() - start_time,
+            "source_count": 0,
+            "tokens_used": 0
+        }
+    
+    def ask(self, question: str) -> Dict:
+        """提问并获取答案"""
+        print(f"🤔 用户问题: {question}")
+        
+        start_time = time.time()
+        
+        cached = self._lookup_cache(question)
+        if cached is not None:
+            return {**cached, "question": question, "response_time": time.time() - start_time, "cache": "semantic_hit"}
+        
+        try:
+            messages, source_docs, citations = self._prepare_messages(question)
             
             # 4. 调用LLM生成答案
             print(" 正在生成答案...")
             response = self.client.chat.completions.create(
                 model=settings.MODEL_NAME,
-                messages=[
-                    {"role": "user", "content": full_prompt}
-                ],
-                temperature=0.1,
+                messages=messages,
+                temperature=self.temperature,
                 max_tokens=1000
             )
             
             answer = response.choices[0].message.content
             
-            # 5. 计算响应时间
-            response_time = time.time() - start_time
-            
-            # 6. 计算置信度
-            confidence = self.calculate_confidence(source_docs, question, answer)
-            
             # 7. 获取token使用量
             tokens_used = response.usage.total_tokens if hasattr(response, 'usage') else None
             
-            result_dict = {
-                "question": question,
-                "answer": answer,
-                "citations": citations,
-                "confidence": confidence,
-                "response_time": response_time,
-                "source_count": len(source_docs),
-                "tokens_used": tokens_used
-            }
+            return self._build_result(question, answer, source_docs, citations, start_time, tokens_used)
+            
+        except Exception as e:
+            return self._error_result(question, e, start_time)
+    
+    def ask_stream(self, question: str, result: Dict = None) -> Iterator[str]:
+        """流式问答：逐段产出答案文本，结束后将完整结果写入result字典"""
+        print(f"🤔 用户问题: {question}")
+        
+        result = result if result is not None else {}
+        start_time = time.time()
+        
+        cached = self._lookup_cache(question)
+        if cached is not None:
+            result.update({**cached, "question": question, "response_time": time.time() - start_time, "cache": "semantic_hit"})
+            yield result["answer"]
+            return
+        
+        try:
+            messages, source_docs, citations = self._prepare_messages(question)
+            
+            # 4. 流式生成答案
+            print(" 正在生成答案...")
+            stream = self.client.chat.completions.create(
+                model=settings.MODEL_NAME,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=1000,
+                stream=True
+            )
             
-            print(f"回答生成完成")
-            print(f"总耗时: {response_time:.2f} 秒")
-            print(f"使用了 {len(source_docs)} 个文档片段")
-            if tokens_used:
-                print(f"消耗 tokens: {tokens_used}")
+            answer_parts = []
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    answer_parts.append(delta)
+                    yield delta
             
-            return result_dict
+            # 流式响应不返回token用量
+            result.update(self._build_result(question, "".join(answer_parts), source_docs, citations, start_time, None))
             
         except Exception as e:
-            print(f"问答失败: {e}")
-            return {
-                "question": question,
-                "answer": f"抱歉，回答问题时出现错误：{str(e)}",
-                "citations": [],
-                "confidence": 0.0,
-                "response_time": time.time() - start_time,
-                "source_count": 0,
-                "tokens_used": 0
-            }
+            result.update(self._error_result(question, e, start_time))
+            yield result["answer"]
     
     def interactive_chat(self):
         """交互式聊天模式"""
@@ -169,8 +352,15 @@ class SimpleRAGChain:
                 if not question:
                     continue
                 
-                result = self.ask(question)
-                print(f"\n 回答: {result['answer']}")
+                if settings.STREAM_ENABLED:
+                    result = {}
+                    print("\n 回答: ", end="", flush=True)
+                    for delta in self.ask_stream(question, result):
+                        print(delta, end="", flush=True)
+                    print()
+                else:
+                    result = self.ask(question)
+                    print(f"\n 回答: {result['answer']}")
                 print(f"置信度: {result['confidence']:.2f}")
                 
                 if result['citations']:
@@ -184,5 +374,21 @@ class SimpleRAGChain:
             except Exception as e:
                 print(f"出现错误: {e}")
 
-# 创建全局RAG链条实例
-rag_chain = SimpleRAGChain()
+# 全局RAG链条实例（首次使用时创建，导入模块不产生初始化开销）
+_rag_chain = None
+_rag_chain_lock = threading.Lock()
+
+def get_rag_chain() -> SimpleRAGChain:
+    """获取全局RAG链条实例（双重检查加锁，并发首次调用时只创建一个实例）"""
+    global _rag_chain
+    if _rag_chain is None:
+        with _rag_chain_lock:
+            if _rag_chain is None:
+                _rag_chain = SimpleRAGChain()
+    return _rag_chain
+
+def __getattr__(name: str):
+    """兼容 from ... import rag_chain 的写法"""
+    if name == "rag_chain":
+        return get_rag_chain()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
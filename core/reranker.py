@@ -2,43 +2,126 @@
 Rerank 重排序模块
 使用简化的相关性评分对检索结果进行重排序
 """
-import openai
+from core.openai_client import openai_client
 from config.settings import settings
-from typing import List, Tuple, Dict
+from core.token_utils import truncate_tokens
+from typing import List, Tuple, Dict, Optional
 from langchain.schema import Document
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib
+import heapq
+import threading
 import re
 
+# FlashRank默认模型（约34MB的INT8量化交叉编码器）
+FLASHRANK_DEFAULT_MODEL = "ms-marco-MiniLM-L-12-v2"
+
+# LLM语义评分缓存上限及磁盘缓存目录（安装了diskcache时跨进程持久化）
+SEMANTIC_SCORE_CACHE_SIZE = 10_000
+SEMANTIC_SCORE_DISK_CACHE_DIR = ".cache/rerank"
+
+# LLM语义评分时每个文档截取的token数（按token截断，中英文文档的评分开销一致）
+SEMANTIC_SCORE_MAX_TOKENS = 200
+
+# 词集合缓存上限（候选文档块在多次查询中反复出现）
+WORD_SET_CACHE_SIZE = 4096
+
+# 预编译的正则：分词、整数评分、批量评分中的数字
+WORD_PATTERN = re.compile(r'\w+')
+INTEGER_PATTERN = re.compile(r'\d+')
+NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+
+@lru_cache(maxsize=WORD_SET_CACHE_SIZE)
+def word_set(text: str) -> frozenset:
+    """文本的小写词集合（正则切分，带缓存）"""
+    return frozenset(WORD_PATTERN.findall(text.lower()))
+
 class SimpleReranker:
     """简化的重排序器"""
     
     def __init__(self):
-        self.client = openai.OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_API_BASE
-        )
+        self.client = openai_client
+        
+        # 交叉编码器按需加载
+        self._cross_encoder = None
+        self._cross_encoder_failed = False
+        self._cross_encoder_lock = threading.Lock()  # 防止预热线程与首个请求重复加载模型
+        self._flashrank = None
+        self._flashrank_failed = False
+        
+        # LLM语义评分LRU缓存
+        self._score_cache: OrderedDict = OrderedDict()
+        self._score_cache_lock = threading.Lock()
+        self._score_disk_cache = self._open_score_disk_cache()
+    
+    def _open_score_disk_cache(self):
+        """打开语义评分磁盘缓存（未安装diskcache时只使用内存缓存）"""
+        try:
+            import diskcache
+            return diskcache.Cache(SEMANTIC_SCORE_DISK_CACHE_DIR)
+        except ImportError:
+            return None
+        except Exception as e:
+            print(f"语义评分磁盘缓存打开失败: {e}")
+            return None
+    
+    def _score_cache_key(self, query: str, document: str) -> str:
+        """语义评分缓存键（模型 + 问题 + 文档内容）"""
+        raw = f"{settings.MODEL_NAME}|{query}|{document}"
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+    
+    def _get_cached_score(self, key: str) -> Optional[float]:
+        """读取缓存的语义评分"""
+        with self._score_cache_lock:
+            score = self._score_cache.get(key)
+            if score is not None:
+                self._score_cache.move_to_end(key)
+                return score
+        
+        if self._score_disk_cache is not None:
+            score = self._score_disk_cache.get(key)
+            if score is not None:
+                self._store_score(key, score, persist=False)
+                return score
+        return None
+    
+    def _store_score(self, key: str, score: float, persist: bool = True):
+        """写入语义评分缓存，超出上限时淘汰最久未使用的条目"""
+        with self._score_cache_lock:
+            self._score_cache[key] = score
+            self._score_cache.move_to_end(key)
+            while len(self._score_cache) > SEMANTIC_SCORE_CACHE_SIZE:
+                self._score_cache.popitem(last=False)
+        
+        if persist and self._score_disk_cache is not None:
+            self._score_disk_cache.set(key, score)
     
     def calculate_lexical_similarity(self, query: str, document: str) -> float:
         """计算词汇相似度"""
-        # 简单的词汇重叠计算
-        query_words = set(re.findall(r'\w+', query.lower()))
-        doc_words = set(re.findall(r'\w+', document.lower()))
+        # 简单的词汇重叠计算（词集合带缓存，|A∪B| = |A| + |B| - |A∩B|）
+        query_words = word_set(query)
+        doc_words = word_set(document)
         
         if not query_words or not doc_words:
             return 0.0
         
-        intersection = query_words & doc_words
-        union = query_words | doc_words
-        
-        return len(intersection) / len(union)
+        intersection = len(query_words & doc_words)
+        return intersection / (len(query_words) + len(doc_words) - intersection)
     
     def calculate_semantic_score(self, query: str, document: str) -> float:
-        """使用LLM计算语义相关性评分"""
+        """使用LLM计算语义相关性评分（相同问题和文档的评分直接命中缓存）"""
+        cache_key = self._score_cache_key(query, document)
+        cached = self._get_cached_score(cache_key)
+        if cached is not None:
+            return cached
+        
         prompt = f"""
 请评估以下文档内容与用户问题的相关性，给出0-10分的评分：
 
 用户问题: {query}
 
-文档内容: {document[:500]}...
+文档内容: {truncate_tokens(document, SEMANTIC_SCORE_MAX_TOKENS)}
 
 评分标准:
 - 10分: 完全相关，直接回答问题
@@ -59,10 +142,12 @@ class SimpleReranker:
             
             score_text = response.choices[0].message.content.strip()
             # 提取数字
-            score_match = re.search(r'\d+', score_text)
+            score_match = INTEGER_PATTERN.search(score_text)
             if score_match:
                 score = float(score_match.group()) / 10.0  # 转换为0-1范围
-                return min(max(score, 0.0), 1.0)
+                score = min(max(score, 0.0), 1.0)
+                self._store_score(cache_key, score)
+                return score
             else:
                 return 0.5  # 默认中等分数
                 
@@ -76,23 +161,30 @@ class SimpleReranker:
         
         print(f"使用简化方法重排序 {len(documents)} 个文档")
         
+        # 问题只切分一次，文档词集合来自缓存
+        query_words = word_set(query)
+        query_len = len(query_words)
+        
         scored_docs = []
         for doc in documents:
+            content = doc.page_content
+            
             # 计算词汇相似度
-            lexical_score = self.calculate_lexical_similarity(query, doc.page_content)
+            doc_words = word_set(content)
+            if query_words and doc_words:
+                intersection = len(query_words & doc_words)
+                lexical_score = intersection / (query_len + len(doc_words) - intersection)
+            else:
+                lexical_score = 0.0
             
             # 简单的长度惩罚（避免过短的文档得分过高）
-            length_factor = min(len(doc.page_content) / 100, 1.0)
+            length_factor = min(len(content) / 100, 1.0)
             
             # 综合评分
-            final_score = lexical_score * 0.8 + length_factor * 0.2
-            
-            scored_docs.append((doc, final_score))
-        
-        # 按分数排序
-        scored_docs.sort(key=lambda x: x[1], reverse=True)
+            scored_docs.append((doc, lexical_score * 0.8 + length_factor * 0.2))
         
-        result = scored_docs[:top_k]
+        # 只选出Top-K（O(N log K)，同分时保持原顺序），无需对全部候选排序
+        result = heapq.nlargest(top_k, scored_docs, key=lambda x: x[1])
         
         print(f"重排序完成，返回Top-{len(result)}")
         for i, (doc, score) in enumerate(result, 1):
@@ -100,23 +192,172 @@ class SimpleReranker:
         
         return result
     
+    def _get_cross_encoder(self):
+        """按需加载交叉编码器（未配置或加载失败时返回None；加锁保证并发调用时只加载一次）"""
+        if self._cross_encoder is not None or not settings.RERANK_MODEL or self._cross_encoder_failed:
+            return self._cross_encoder
+        
+        with self._cross_encoder_lock:
+            if self._cross_encoder is None and not self._cross_encoder_failed:
+                try:
+                    from sentence_transformers import CrossEncoder
+                    import torch
+                    
+                    device = "cuda" if torch.cuda.is_available() else "cpu"
+                    model_kwargs = {}
+                    if settings.RERANK_BACKEND != "torch":
+                        # ONNX/OpenVINO后端（sentence-transformers>=3.2），可指定int8量化模型文件
+                        model_kwargs["backend"] = settings.RERANK_BACKEND
+                        if settings.RERANK_MODEL_FILE:
+                            model_kwargs["model_kwargs"] = {"file_name": settings.RERANK_MODEL_FILE}
+                    
+                    model = CrossEncoder(settings.RERANK_MODEL, max_length=512, device=device, **model_kwargs)
+                    
+                    # GPU上的PyTorch后端使用半精度推理
+                    if device == "cuda" and settings.RERANK_BACKEND == "torch":
+                        model.model.half()
+                    # 模型完全就绪后再对其他线程可见
+                    self._cross_encoder = model
+                    print(f"交叉编码器加载完成: {settings.RERANK_MODEL} ({settings.RERANK_BACKEND}, {device})")
+                except Exception as e:
+                    print(f"交叉编码器加载失败，回退到简化重排序: {e}")
+                    self._cross_encoder_failed = True
+        return self._cross_encoder
+    
+    def warmup(self):
+        """预加载交叉编码器（供启动时的后台预热线程调用）"""
+        self._get_cross_encoder()
+    
+    def cross_encoder_rerank(self, query: str, documents: List[Document], top_k: int = None) -> List[Tuple[Document, float]]:
+        """交叉编码器重排序（所有候选文档一次批量前向计算）"""
+        top_k = top_k or len(documents)
+        
+        model = self._get_cross_encoder()
+        if model is None:
+            return self.simple_rerank(query, documents, top_k)
+        if not documents:
+            return []
+        
+        print(f"使用交叉编码器重排序 {len(documents)} 个文档")
+        
+        # 所有(查询, 文档)对组成一个批次，避免逐对推理
+        pairs = [(query, doc.page_content) for doc in documents]
+        scores = model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        
+        scored_docs = [(doc, float(score)) for doc, score in zip(documents, scores)]
+        scored_docs.sort(key=lambda x: x[1], reverse=True)
+        
+        result = scored_docs[:top_k]
+        
+        print(f"交叉编码器重排序完成，返回Top-{len(result)}")
+        return result
+    
+    def _get_flashrank(self):
+        """按需加载FlashRank排序器（自带INT8量化ONNX模型，加载失败时返回None）"""
+        if self._flashrank is None and not self._flashrank_failed:
+            try:
+                from flashrank import Ranker
+                
+                model_name = settings.RERANK_MODEL or FLASHRANK_DEFAULT_MODEL
+                self._flashrank = Ranker(model_name=model_name, max_length=512)
+                print(f"FlashRank排序器加载完成: {model_name}")
+            except Exception as e:
+                print(f"FlashRank加载失败，回退到简化重排序: {e}")
+                self._flashrank_failed = True
+        return self._flashrank
+    
+    def flashrank_rerank(self, query: str, documents: List[Document], top_k: int = None) -> List[Tuple[Document, float]]:
+        """FlashRank重排序（ONNX Runtime批量推理所有候选文档）"""
+        top_k = top_k or len(documents)
+        
+        ranker = self._get_flashrank()
+        if ranker is None:
+            return self.simple_rerank(query, documents, top_k)
+        if not documents:
+            return []
+        
+        print(f"使用FlashRank重排序 {len(documents)} 个文档")
+        
+        from flashrank import RerankRequest
+        passages = [{"id": i, "text": doc.page_content} for i, doc in enumerate(documents)]
+        ranked = ranker.rerank(RerankRequest(query=query, passages=passages))
+        
+        result = [(documents[item["id"]], float(item["score"])) for item in ranked[:top_k]]
+        
+        print(f"FlashRank重排序完成，返回Top-{len(result)}")
+        return result
+    
+    def rerank(self, query: str, documents: List[Document], top_k: int = None) -> List[Tuple[Document, float]]:
+        """按配置选择重排序方法：FlashRank后端、交叉编码器（配置了RERANK_MODEL），否则使用简化方法"""
+        if settings.RERANK_BACKEND == "flashrank":
+            return self.flashrank_rerank(query, documents, top_k)
+        if settings.RERANK_MODEL:
+            return self.cross_encoder_rerank(query, documents, top_k)
+        return self.simple_rerank(query, documents, top_k)
+    
+    def calculate_semantic_scores_batch(self, query: str, documents: List[Document]) -> List[float]:
+        """一次LLM调用为所有文档计算语义相关性评分（解析失败时逐个评分）"""
+        keys = [self._score_cache_key(query, doc.page_content) for doc in documents]
+        scores = [self._get_cached_score(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if not missing:
+            return scores
+        
+        doc_lines = "".join(f"[{n}] {truncate_tokens(documents[i].page_content, SEMANTIC_SCORE_MAX_TOKENS)}\n\n" for n, i in enumerate(missing))
+        prompt = f"""
+请评估以下每个文档内容与用户问题的相关性，分别给出0-10分的评分：
+
+用户问题: {query}
+
+{doc_lines}评分标准:
+- 10分: 完全相关，直接回答问题
+- 8-9分: 高度相关，包含重要信息
+- 6-7分: 中等相关，有一定参考价值
+- 4-5分: 低度相关，包含少量相关信息
+- 0-3分: 不相关或无关
+
+请按文档编号顺序只返回一个JSON数组，包含{len(missing)}个数字评分，例如 [8, 3, 6]:"""
+        
+        parsed = []
+        try:
+            response = self.client.chat.completions.create(
+                model=settings.MODEL_NAME,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.1,
+                max_tokens=10 + 6 * len(missing)
+            )
+            score_text = response.choices[0].message.content.strip()
+            parsed = [float(x) for x in NUMBER_PATTERN.findall(score_text)]
+        except Exception as e:
+            print(f"批量语义评分失败: {e}")
+        
+        if len(parsed) != len(missing):
+            print(f"批量评分解析数量不符（{len(parsed)}/{len(missing)}），回退到逐个评分")
+            for i in missing:
+                scores[i] = self.calculate_semantic_score(query, documents[i].page_content)
+            return scores
+        
+        for i, raw in zip(missing, parsed):
+            score = min(max(raw / 10.0, 0.0), 1.0)  # 转换为0-1范围
+            self._store_score(keys[i], score)
+            scores[i] = score
+        return scores
+    
     def advanced_rerank(self, query: str, documents: List[Document], top_k: int = None) -> List[Tuple[Document, float]]:
-        """高级重排序方法（使用LLM语义评分）"""
+        """高级重排序方法（使用LLM语义评分，所有文档合并为一次调用）"""
         top_k = top_k or len(documents)
         
         print(f"使用高级方法重排序 {len(documents)} 个文档")
         print("注意：此方法会消耗较多API调用")
         
+        # 计算语义相似度（使用LLM，一次调用）
+        semantic_scores = self.calculate_semantic_scores_batch(query, documents)
+        
         scored_docs = []
-        for i, doc in enumerate(documents, 1):
-            print(f"   评估文档 {i}/{len(documents)}...")
-            
+        for doc, semantic_score in zip(documents, semantic_scores):
             # 计算词汇相似度
             lexical_score = self.calculate_lexical_similarity(query, doc.page_content)
             
-            # 计算语义相似度（使用LLM）
-            semantic_score = self.calculate_semantic_score(query, doc.page_content)
-            
             # 综合评分
             final_score = lexical_score * 0.3 + semantic_score * 0.7
             
@@ -154,5 +395,21 @@ class SimpleReranker:
             "documents_count": len(documents)
         }
 
-# 创建全局重排序器实例
-reranker = SimpleReranker()
+# 全局重排序器实例（首次使用时创建，导入模块不产生初始化开销）
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def get_reranker() -> SimpleReranker:
+    """获取全局重排序器实例（双重检查加锁，并发首次调用时只创建一个实例）"""
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = SimpleReranker()
+    return _reranker
+
+def __getattr__(name: str):
+    """兼容 from ... import reranker 的写法"""
+    if name == "reranker":
+        return get_reranker()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
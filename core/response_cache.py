@@ -0,0 +1,81 @@
+"""
+语义响应缓存模块
+相同或语义相近的问题直接返回缓存的回答，跳过检索和生成
+"""
+import threading
+import time
+import numpy as np
+from typing import Callable, Dict, List, Optional
+
+class SemanticResponseCache:
+    """语义响应缓存（问题向量余弦相似度匹配，TTL过期 + LRU淘汰）"""
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 1800, sim_threshold: float = 0.93,
+                 embed_fn: Callable[[str], List[float]] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sim_threshold = sim_threshold
+        self.embed_fn = embed_fn
+
+        # 归一化问题向量矩阵（首次写入时按向量维度分配），以及对应槽位的结果、写入时间和最近使用时间
+        self._matrix = None
+        self._results = [None] * max_entries
+        self._created_at = np.zeros(max_entries)
+        self._last_used = np.zeros(max_entries)
+        self._lock = threading.Lock()
+
+    def _embed(self, question: str) -> np.ndarray:
+        """向量化问题并归一化（默认与向量库使用同一向量化模型）"""
+        if self.embed_fn is None:
+            from core.vector_store_compatible import vector_store
+            self.embed_fn = vector_store.embeddings.embed_query
+        vector = np.asarray(self.embed_fn(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _valid_mask(self, now: float) -> np.ndarray:
+        """未过期的已占用槽位"""
+        return (self._created_at > 0) & (self._created_at > now - self.ttl)
+
+    def lookup(self, question: str) -> Optional[Dict]:
+        """查找语义相近问题的缓存结果，未命中返回None"""
+        if self._matrix is None:
+            return None
+
+        vector = self._embed(question)
+        with self._lock:
+            now = time.time()
+            valid = self._valid_mask(now)
+            if not valid.any():
+                return None
+
+            # 一次矩阵乘法计算与所有缓存问题的余弦相似度
+            similarities = np.where(valid, self._matrix @ vector, -1.0)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.sim_threshold:
+                return None
+
+            self._last_used[best] = now
+            print(f"⚡ 语义缓存命中 (相似度 {similarities[best]:.3f})")
+            return dict(self._results[best])
+
+    def insert(self, question: str, result: Dict):
+        """写入缓存（优先使用空闲或过期槽位，否则淘汰最久未使用的条目）"""
+        vector = self._embed(question)
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+
+            now = time.time()
+            slot = int(np.argmin(np.where(self._valid_mask(now), self._last_used, 0.0)))
+            self._matrix[slot] = vector
+            self._results[slot] = dict(result)
+            self._created_at[slot] = now
+            self._last_used[slot] = now
+
+    def clear(self):
+        """清空缓存（底层数据变化时调用）"""
+        with self._lock:
+            self._results = [None] * self.max_entries
+            self._created_at[:] = 0
+            self._last_used[:] = 0
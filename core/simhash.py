@@ -0,0 +1,51 @@
+"""
+SimHash 近似去重模块
+基于字符n-gram计算64位SimHash指纹，用汉明距离判断近似重复的文档块
+"""
+import hashlib
+import re
+import numpy as np
+from typing import List
+from langchain.schema import Document
+
+# 字符n-gram长度（按字符切分，中英文通用）
+SHINGLE_SIZE = 3
+
+# 汉明距离不超过该阈值视为近似重复
+NEAR_DUPLICATE_DISTANCE = 3
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+_BIT_POSITIONS = np.arange(64, dtype=np.uint64)
+
+def compute_simhash(text: str) -> int:
+    """计算文本的64位SimHash指纹"""
+    normalized = WHITESPACE_PATTERN.sub("", text.lower())
+    if len(normalized) < SHINGLE_SIZE:
+        shingles = [normalized]
+    else:
+        shingles = [normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)]
+
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles)
+    )
+
+    # 统计每一位上为1的n-gram数量，超过半数的位在指纹中置1
+    bit_counts = ((hashes[:, None] >> _BIT_POSITIONS) & np.uint64(1)).sum(axis=0)
+    fingerprint = 0
+    for i in np.flatnonzero(bit_counts * 2 > len(shingles)):
+        fingerprint |= 1 << int(i)
+    return fingerprint
+
+def document_simhash(doc: Document) -> int:
+    """获取文档块的SimHash（优先使用入库时写入元数据的值）"""
+    cached = doc.metadata.get("simhash")
+    if cached:
+        return int(cached, 16)
+    return compute_simhash(doc.page_content)
+
+def is_near_duplicate(fingerprint: int, seen: List[int], max_distance: int = NEAR_DUPLICATE_DISTANCE) -> bool:
+    """判断指纹与已接受的指纹之间是否存在近似重复"""
+    return any(bin(fingerprint ^ other).count("1") <= max_distance for other in seen)
@@ -0,0 +1,27 @@
+"""
+Token工具模块
+按模型的tiktoken编码器统计和截断文本
+"""
+from config.settings import settings
+from functools import lru_cache
+import tiktoken
+
+@lru_cache(maxsize=None)
+def get_token_encoder(model_name: str):
+    """获取模型对应的tiktoken编码器（进程内只创建一次，未知模型使用cl100k_base）"""
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text: str) -> int:
+    """统计文本的token数"""
+    return len(get_token_encoder(settings.MODEL_NAME).encode(text))
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """将文本截断到指定token数"""
+    encoder = get_token_encoder(settings.MODEL_NAME)
+    tokens = encoder.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoder.decode(tokens[:max_tokens]) + "..."
@@ -1,68 +1,166 @@
-import openai
+from core.openai_client import openai_client
+from core.token_utils import get_token_encoder
+from core.response_cache import SemanticResponseCache
 from langchain_community.vectorstores import Chroma
 from langchain.schema import Document
 from config.settings import settings
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
 import numpy as np
 
+# HyQE假设性问题索引的集合名称
+HYPOTHETICAL_QUESTION_COLLECTION = "hypothetical_questions"
+
+# 查询向量缓存条目数（重复问题无需再次调用向量化接口）
+QUERY_EMBEDDING_CACHE_SIZE = 2048
+
+# 文档向量化时同时在途的批次请求数
+EMBEDDING_MAX_WORKERS = 8
+
+# 检索结果语义缓存：条目数、有效期（秒）、命中所需的问题余弦相似度
+SEARCH_CACHE_SIZE = 1024
+SEARCH_CACHE_TTL = 3600
+SEARCH_CACHE_THRESHOLD = 0.95
+
+# 向量化模型及单条输入的token上限
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+
 class CompatibleEmbeddings:
     """兼容的向量化类"""
     
     def __init__(self):
-        self.client = openai.OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_API_BASE
-        )
+        self.client = openai_client
+        self.cache = self._open_cache()
+    
+    def _open_cache(self):
+        """打开向量磁盘缓存（未安装diskcache时不缓存）"""
+        try:
+            import diskcache
+            return diskcache.Cache(settings.EMBED_CACHE_DIR)
+        except ImportError:
+            return None
+        except Exception as e:
+            print(f"向量缓存打开失败: {e}")
+            return None
+    
+    def _cache_key(self, text: str) -> str:
+        """向量缓存键（模型 + 文本内容）"""
+        return hashlib.blake2b(f"{EMBEDDING_MODEL}\0{text}".encode("utf-8"), digest_size=16).hexdigest()
+    
+    def _cache_get(self, key: str) -> Optional[List[float]]:
+        """读取缓存的向量"""
+        if self.cache is None:
+            return None
+        data = self.cache.get(key)
+        return np.frombuffer(data, dtype=np.float32).tolist() if data is not None else None
+    
+    def _cache_set(self, key: str, embedding: List[float]):
+        """写入向量缓存（回退生成的零向量不缓存）"""
+        if self.cache is not None and any(embedding):
+            self.cache.set(key, np.asarray(embedding, dtype=np.float32).tobytes())
+    
+    def _embed_batch(self, batch_number: int, batch: List[str]) -> List[List[float]]:
+        """向量化一个批次（批量调用失败时回退到逐个处理）"""
+        try:
+            # 批量调用API
+            response = self.client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=batch
+            )
+            
+            # 提取向量
+            return [item.embedding for item in response.data]
+            
+        except Exception as e:
+            print(f"批次 {batch_number} 处理失败: {e}")
+            # 回退到单个处理
+            embeddings = []
+            for text in batch:
+                try:
+                    response = self.client.embeddings.create(
+                        model=EMBEDDING_MODEL,
+                        input=text
+                    )
+                    embeddings.append(response.data[0].embedding)
+                except Exception as single_e:
+                    print(f"单个文档向量化失败: {single_e}")
+                    # 使用零向量作为备用
+                    embeddings.append([0.0] * 1536)
+            return embeddings
+    
+    def _pack_batches(self, texts: List[str]) -> Tuple[List[str], List[List[int]]]:
+        """按token数装箱：超长文本截断到模型上限，按长度降序首次适应放入批次（同时受输入条数和token总数限制）"""
+        encoder = get_token_encoder(EMBEDDING_MODEL)
+        token_counts = []
+        packed_texts = []
+        for text, tokens in zip(texts, encoder.encode_batch(texts)):
+            if len(tokens) > EMBEDDING_MAX_INPUT_TOKENS:
+                text = encoder.decode(tokens[:EMBEDDING_MAX_INPUT_TOKENS])
+            packed_texts.append(text)
+            token_counts.append(min(len(tokens), EMBEDDING_MAX_INPUT_TOKENS))
+        
+        max_inputs = settings.EMBEDDING_BATCH_SIZE
+        max_tokens = settings.EMBEDDING_MAX_BATCH_TOKENS
+        batches = []
+        batch_tokens = []
+        for index in sorted(range(len(texts)), key=lambda i: token_counts[i], reverse=True):
+            tokens = token_counts[index]
+            for batch_number, batch in enumerate(batches):
+                if len(batch) < max_inputs and batch_tokens[batch_number] + tokens <= max_tokens:
+                    batch.append(index)
+                    batch_tokens[batch_number] += tokens
+                    break
+            else:
+                batches.append([index])
+                batch_tokens.append(tokens)
+        return packed_texts, batches
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """向量化多个文档 - 批处理优化"""
-        embeddings = []
-        batch_size = 10  # 批处理大小
+        """向量化多个文档 - 先查磁盘缓存，未命中的按token数装箱批处理，多个批次并发请求"""
+        keys = [self._cache_key(text) for text in texts]
+        embeddings = [self._cache_get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if len(missing) < len(texts):
+            print(f"向量缓存命中 {len(texts) - len(missing)} 个文档块")
         
-        print(f"正在向量化 {len(texts)} 个文档块...")
+        missing_texts, index_batches = self._pack_batches([texts[i] for i in missing])
         
-        # 分批处理
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            print(f"处理批次 {i//batch_size + 1}/{(len(texts) + batch_size - 1)//batch_size}")
-            
-            try:
-                # 批量调用API
-                response = self.client.embeddings.create(
-                    model="text-embedding-ada-002",
-                    input=batch
-                )
-                
-                # 提取向量
-                batch_embeddings = [item.embedding for item in response.data]
-                embeddings.extend(batch_embeddings)
-                
-            except Exception as e:
-                print(f"批次 {i//batch_size + 1} 处理失败: {e}")
-                # 回退到单个处理
-                for text in batch:
-                    try:
-                        response = self.client.embeddings.create(
-                            model="text-embedding-ada-002",
-                            input=text
-                        )
-                        embeddings.append(response.data[0].embedding)
-                    except Exception as single_e:
-                        print(f"单个文档向量化失败: {single_e}")
-                        # 使用零向量作为备用
-                        embeddings.append([0.0] * 1536)
+        print(f"正在向量化 {len(missing_texts)} 个文档块，共 {len(index_batches)} 个批次...")
+        
+        # 各批次的网络请求互相独立，并发执行，结果按原始顺序写回
+        batches = [[missing_texts[i] for i in indices] for indices in index_batches]
+        with ThreadPoolExecutor(max_workers=max(1, min(len(batches), EMBEDDING_MAX_WORKERS))) as executor:
+            for indices, batch_embeddings in zip(index_batches, executor.map(self._embed_batch, range(1, len(batches) + 1), batches)):
+                for i, embedding in zip(indices, batch_embeddings):
+                    embeddings[missing[i]] = embedding
+                    self._cache_set(keys[missing[i]], embedding)
         
         print(f"向量化完成，共 {len(embeddings)} 个向量")
         return embeddings
     
     def embed_query(self, text: str) -> List[float]:
-        """向量化单个查询"""
+        """向量化单个查询（带LRU缓存）"""
+        return list(self._embed_query_cached(text))
+    
+    @lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+    def _embed_query_cached(self, text: str) -> Tuple[float, ...]:
+        """调用接口向量化查询（先查磁盘缓存），结果以不可变元组缓存（调用失败时不缓存）"""
+        key = self._cache_key(text)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return tuple(cached)
+        
         response = self.client.embeddings.create(
-            model="text-embedding-ada-002",
+            model=EMBEDDING_MODEL,
             input=text
         )
-        return response.data[0].embedding
+        embedding = response.data[0].embedding
+        self._cache_set(key, embedding)
+        return tuple(embedding)
 
 class VectorStoreManager:
     """向量存储管理器 - 兼容版本"""
@@ -71,14 +169,66 @@ class VectorStoreManager:
         """初始化向量存储"""
         self.embeddings = CompatibleEmbeddings()
         
+        # 检索结果语义缓存（相近问题直接复用检索结果，写入新文档时清空）
+        self.search_cache = SemanticResponseCache(
+            max_entries=SEARCH_CACHE_SIZE,
+            ttl=SEARCH_CACHE_TTL,
+            sim_threshold=SEARCH_CACHE_THRESHOLD,
+            embed_fn=self.embeddings.embed_query
+        )
+        # 依赖向量库内容的缓存（检索缓存及问答链的回答缓存），写入新文档时统一清空
+        self.dependent_caches = [self.search_cache]
+        
         # 确保向量数据库目录存在
         os.makedirs(settings.CHROMA_PERSIST_DIR, exist_ok=True)
         
-        # 初始化或加载向量数据库
+        # 初始化或加载向量数据库（HNSW近似最近邻索引，避免暴力扫描）
+        self.collection_metadata = {
+            "hnsw:space": settings.HNSW_SPACE,
+            "hnsw:M": settings.HNSW_M,
+            "hnsw:construction_ef": settings.HNSW_CONSTRUCTION_EF,
+            "hnsw:search_ef": settings.HNSW_SEARCH_EF
+        }
         self.vectorstore = Chroma(
             persist_directory=settings.CHROMA_PERSIST_DIR,
-            embedding_function=self.embeddings
+            embedding_function=self.embeddings,
+            collection_metadata=self.collection_metadata
         )
+        self._question_store = None
+    
+    @property
+    def question_store(self) -> Chroma:
+        """HyQE假设性问题索引（独立集合，首次使用时创建）"""
+        if self._question_store is None:
+            self._question_store = Chroma(
+                collection_name=HYPOTHETICAL_QUESTION_COLLECTION,
+                persist_directory=settings.CHROMA_PERSIST_DIR,
+                embedding_function=self.embeddings,
+                collection_metadata=self.collection_metadata
+            )
+        return self._question_store
+    
+    def register_dependent_cache(self, cache):
+        """注册依赖向量库内容的缓存（需提供clear方法），文档写入后随检索缓存一起清空"""
+        self.dependent_caches.append(cache)
+    
+    def clear_caches(self):
+        """清空所有依赖向量库内容的缓存"""
+        for cache in self.dependent_caches:
+            cache.clear()
+    
+    def add_hypothetical_questions(self, questions: List[Document]) -> List[str]:
+        """添加假设性问题到HyQE索引（元数据中保存所属文档块内容）"""
+        print(f"正在索引 {len(questions)} 个假设性问题...")
+        ids = self.question_store.add_documents(questions)
+        self.question_store.persist()
+        self.clear_caches()
+        return ids
+    
+    def hypothetical_question_search(self, query: str, k: int = None) -> List[Document]:
+        """在HyQE索引中搜索与查询相似的假设性问题"""
+        k = k or settings.TOP_K
+        return self.question_store.similarity_search(query, k=k)
     
     def add_documents(self, documents: List[Document]) -> List[str]:
         """添加文档到向量数据库"""
@@ -89,21 +239,87 @@ class VectorStoreManager:
         
         # 持久化存储
         self.vectorstore.persist()
+        self.clear_caches()
         
         print(f"向量化完成，生成 {len(ids)} 个向量")
         return ids
     
+    def has_file_hash(self, file_hash: str) -> bool:
+        """检查向量库中是否已有该文件哈希的文档块（按元数据过滤，仅取1条ID）"""
+        try:
+            existing = self.vectorstore._collection.get(where={"file_hash": file_hash}, limit=1, include=[])
+            return bool(existing["ids"])
+        except Exception as e:
+            print(f"检查文件哈希失败: {e}")
+            return False
+    
+    def count(self) -> int:
+        """向量库中的文档块数量"""
+        return self.vectorstore._collection.count()
+    
+    def get_all_documents(self) -> List[Document]:
+        """读取向量库中的全部文档块（不含向量）"""
+        results = self.vectorstore._collection.get(include=["documents", "metadatas"])
+        return [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(results["documents"], results["metadatas"])
+        ]
+    
     def similarity_search(self, query: str, k: int = None) -> List[Document]:
         """相似度搜索"""
         k = k or settings.TOP_K
         print(f"正在搜索相关文档，返回Top-{k}...")
         
-        # 执行相似度搜索
-        results = self.vectorstore.similarity_search(query, k=k)
+        # 相近问题且缓存结果数量足够时直接复用
+        try:
+            cached = self.search_cache.lookup(query)
+        except Exception as e:
+            print(f"检索缓存查询失败: {e}")
+            cached = None
+        if cached is not None and cached["k"] >= k:
+            return cached["documents"][:k]
+        
+        # 执行相似度搜索（查询向量来自LRU缓存，与上面的缓存查询共用一次向量化）
+        results = self.vectorstore.similarity_search_by_vector(self.embeddings.embed_query(query), k=k)
+        
+        try:
+            self.search_cache.insert(query, {"k": k, "documents": results})
+        except Exception as e:
+            print(f"检索缓存写入失败: {e}")
+        
+        print(f"找到 {len(results)} 个相关文档块")
+        return results
+    
+    def similarity_search_with_relevance(self, query: str, k: int = None) -> List[Tuple[Document, float]]:
+        """带归一化相关性分数（0-1，越大越相关）的搜索"""
+        k = k or settings.TOP_K
+        print(f"正在搜索相关文档（带相关性分数），返回Top-{k}...")
+        
+        results = self.vectorstore.similarity_search_with_relevance_scores(query, k=k)
         
         print(f"找到 {len(results)} 个相关文档块")
         return results
     
+    def similarity_search_batch(self, queries: List[str], k: int = None) -> List[List[Document]]:
+        """批量相似度搜索：所有查询一次向量化请求、一次索引查询"""
+        k = k or settings.TOP_K
+        print(f"正在批量搜索 {len(queries)} 个查询，每个返回Top-{k}...")
+        
+        query_embeddings = self.embeddings.embed_documents(queries)
+        results = self.vectorstore._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=k,
+            include=["documents", "metadatas"]
+        )
+        
+        batch_results = [
+            [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+            for texts, metadatas in zip(results["documents"], results["metadatas"])
+        ]
+        
+        print(f"找到 {[len(docs) for docs in batch_results]} 个相关文档块")
+        return batch_results
+    
     def similarity_search_with_score(self, query: str, k: int = None) -> List[Tuple[Document, float]]:
         """带相似度分数的搜索"""
         k = k or settings.TOP_K
@@ -127,7 +343,7 @@ class VectorStoreManager:
             
             return {
                 'total_documents': count,
-                'embedding_model': 'text-embedding-ada-002',
+                'embedding_model': EMBEDDING_MODEL,
                 'vector_dimension': 1536,
                 'persist_directory': settings.CHROMA_PERSIST_DIR
             }
@@ -1,13 +1,34 @@
-from sqlalchemy import create_engine
+from sqlalchemy import JSON, create_engine, insert, inspect, text
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.exc import SQLAlchemyError
 from config.settings import settings
 from database.models import Base, Conversation, QALog, UserFeedback, DocumentMetadata
-import json
+import orjson
+import pandas as pd
 import uuid
 import time
+import queue
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, Iterator, List, Dict, Any
+
+# FLOOR(confidence * 5) 分桶到置信度区间标签（<0.4的桶0、1合并为1，1.0所在的桶5合并为4）
+CONFIDENCE_BUCKET_LABELS = {
+    1: 'Very Low (<0.4)',
+    2: 'Low (0.4-0.6)',
+    3: 'Medium (0.6-0.8)',
+    4: 'High (0.8+)'
+}
+
+def confidence_distribution(buckets: pd.DataFrame) -> pd.DataFrame:
+    """将 (bucket, count) 分桶计数合并为置信度区间分布（索引为range，列为count，空区间不输出）"""
+    ranges = buckets["bucket"].clip(lower=1, upper=4).astype(int).map(CONFIDENCE_BUCKET_LABELS)
+    return (
+        buckets.groupby(ranges)["count"].sum()
+        .reindex(list(CONFIDENCE_BUCKET_LABELS.values())).dropna().astype(int)
+        .rename_axis("range").to_frame("count")
+    )
 
 class DatabaseManager:
     """数据库管理器"""
@@ -17,42 +38,135 @@ class DatabaseManager:
         self.engine = create_engine(
             settings.mysql_url,
             echo=False,  # 设为True可以看到SQL语句
-            pool_size=10,  # 连接池大小
-            max_overflow=20  # 最大溢出连接数
+            pool_size=settings.DB_POOL_SIZE,  # 连接池大小
+            max_overflow=settings.DB_MAX_OVERFLOW,  # 最大溢出连接数
+            pool_pre_ping=True,  # 取出连接前检测可用性，避免使用已被服务端断开的连接
+            pool_recycle=settings.DB_POOL_RECYCLE,  # 定期回收连接，早于MySQL的wait_timeout
+            pool_timeout=settings.DB_POOL_TIMEOUT,  # 连接池耗尽时的等待上限，避免长时间阻塞
+            pool_use_lifo=True,  # 优先复用最近归还的连接，空闲连接可被自然回收
+            json_serializer=lambda value: orjson.dumps(value).decode("utf-8"),  # JSON列使用orjson序列化
+            json_deserializer=orjson.loads
         )
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        
+        # 问答日志后台写入队列
+        self.log_queue = queue.Queue()
+        self._log_worker = None
+        self._log_worker_lock = threading.Lock()
+        
+        # 会话session_id到主键的缓存（会话创建后不会变化），写日志时省去查询
+        self._conversation_ids: Dict[str, int] = {}
     
     def create_tables(self):
         """创建数据库表"""
         try:
             Base.metadata.create_all(bind=self.engine)
+            self._add_missing_columns()
+            self._migrate_citations_column()
+            self._create_missing_indexes()
             print("数据库表创建成功！")
         except SQLAlchemyError as e:
             print(f"数据库表创建失败: {e}")
             raise
     
+    def _add_missing_columns(self):
+        """为已存在的表补加模型中新增的可空列（create_all不会修改已有的表）"""
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    print(f"无法自动添加非空列 {table.name}.{column.name}，请手动迁移")
+                    continue
+                column_type = column.type.compile(dialect=self.engine.dialect)
+                with self.engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} NULL"))
+                print(f"已添加列 {table.name}.{column.name}")
+    
+    def _migrate_citations_column(self):
+        """将旧版TEXT类型的qa_logs.citations转换为原生JSON列（已有内容均为合法JSON文本）"""
+        inspector = inspect(self.engine)
+        columns = {column["name"]: column["type"] for column in inspector.get_columns("qa_logs")}
+        citations_type = columns.get("citations")
+        if citations_type is not None and not isinstance(citations_type, JSON):
+            with self.engine.begin() as connection:
+                connection.execute(text("ALTER TABLE qa_logs MODIFY citations JSON NULL"))
+            print("已将 qa_logs.citations 转换为JSON列")
+    
+    def _create_missing_indexes(self):
+        """为已存在的表补建模型中新增的索引（create_all不会修改已有的表）"""
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            existing_indexes = inspector.get_indexes(table.name)
+            existing_names = {index["name"] for index in existing_indexes}
+            # 同列同唯一性的索引已存在（如早期以 unique=True 建表时自动命名的唯一索引）时不再重复创建
+            existing_columns = {(tuple(index["column_names"]), bool(index["unique"])) for index in existing_indexes}
+            for index in table.indexes:
+                signature = (tuple(column.name for column in index.columns), bool(index.unique))
+                if index.name not in existing_names and signature not in existing_columns:
+                    index.create(bind=self.engine)
+                    print(f"已创建索引 {table.name}.{index.name}")
+    
     def get_session(self) -> Session:
         """获取数据库会话"""
         return self.SessionLocal()
     
+    @contextmanager
+    def _session(self) -> Iterator[Session]:
+        """事务会话：正常结束时提交，出错时回滚并抛出，最后关闭"""
+        session = self.SessionLocal()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    
+    def ping(self) -> bool:
+        """检查数据库连接是否可用"""
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            return True
+        except SQLAlchemyError as e:
+            print(f"数据库连接检查失败: {e}")
+            return False
+    
+    def warm_pool(self, size: int = None) -> int:
+        """预热连接池：同时取出size个连接再全部归还，返回成功建立的连接数"""
+        size = size or settings.DB_POOL_SIZE
+        connections = []
+        try:
+            for _ in range(size):
+                connections.append(self.engine.connect())
+        except SQLAlchemyError as e:
+            print(f"连接池预热中断: {e}")
+        finally:
+            for connection in connections:
+                connection.close()
+        return len(connections)
+    
     def create_conversation(self, user_id: str = "anonymous") -> str:
         """创建新对话会话"""
-        session = self.get_session()
         try:
-            session_id = f"{user_id}_{uuid.uuid4().hex[:8]}"
-            conversation = Conversation(
-                session_id=session_id,
-                user_id=user_id
-            )
-            session.add(conversation)
-            session.commit()
+            with self._session() as session:
+                session_id = f"{user_id}_{uuid.uuid4().hex[:8]}"
+                conversation = Conversation(
+                    session_id=session_id,
+                    user_id=user_id
+                )
+                session.add(conversation)
+                session.flush()
+                conversation_id = conversation.id
+            self._conversation_ids[session_id] = conversation_id
             return session_id
         except SQLAlchemyError as e:
-            session.rollback()
             print(f"创建对话失败: {e}")
             raise
-        finally:
-            session.close()
     
     def log_qa(self, 
                session_id: str,
@@ -62,54 +176,156 @@ class DatabaseManager:
                confidence: float = None,
                response_time: float = None,
                tokens_used: int = None,
-               model_name: str = None) -> int:
-        """记录问答日志"""
-        session = self.get_session()
+               model_name: str = None,
+               conversation_id: int = None) -> int:
+        """记录问答日志（调用方已知会话主键时可直接传入conversation_id，省去查询）"""
         try:
-            # 获取会话ID
-            conversation = session.query(Conversation).filter_by(session_id=session_id).first()
-            if not conversation:
-                raise ValueError(f"会话 {session_id} 不存在")
+            with self._session() as session:
+                # 获取会话ID
+                if conversation_id is None:
+                    conversation_id = self._get_conversation_ids(session, [session_id]).get(session_id)
+                if conversation_id is None:
+                    raise ValueError(f"会话 {session_id} 不存在")
+                
+                # 创建问答记录
+                qa_log = QALog(
+                    conversation_id=conversation_id,
+                    question=question,
+                    answer=answer,
+                    citations=citations or None,
+                    confidence=confidence,
+                    response_time=response_time,
+                    tokens_used=tokens_used,
+                    model_name=model_name or settings.MODEL_NAME
+                )
+                session.add(qa_log)
+                session.flush()
+                return qa_log.id
+        except SQLAlchemyError as e:
+            print(f"记录问答失败: {e}")
+            raise
+    
+    def log_qa_async(self,
+                     session_id: str,
+                     question: str,
+                     answer: str,
+                     citations: List[Dict] = None,
+                     confidence: float = None,
+                     response_time: float = None,
+                     tokens_used: int = None,
+                     model_name: str = None):
+        """异步记录问答日志（放入后台队列，不阻塞调用线程）"""
+        self._ensure_log_worker()
+        self.log_queue.put({
+            "session_id": session_id,
+            "question": question,
+            "answer": answer,
+            "citations": citations,
+            "confidence": confidence,
+            "response_time": response_time,
+            "tokens_used": tokens_used,
+            "model_name": model_name
+        })
+    
+    def _ensure_log_worker(self):
+        """按需启动后台写入线程"""
+        if self._log_worker is not None and self._log_worker.is_alive():
+            return
+        with self._log_worker_lock:
+            if self._log_worker is None or not self._log_worker.is_alive():
+                self._log_worker = threading.Thread(target=self._log_worker_loop, name="qa-log-writer", daemon=True)
+                self._log_worker.start()
+    
+    def _log_worker_loop(self):
+        """后台线程：每200ms批量写入最多64条问答日志"""
+        while True:
+            records = [self.log_queue.get()]
+            deadline = time.time() + 0.2
+            while len(records) < 64:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    records.append(self.log_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
             
-            # 创建问答记录
-            qa_log = QALog(
-                conversation_id=conversation.id,
-                question=question,
-                answer=answer,
-                citations=json.dumps(citations, ensure_ascii=False) if citations else None,
-                confidence=confidence,
-                response_time=response_time,
-                tokens_used=tokens_used,
-                model_name=model_name or settings.MODEL_NAME
+            try:
+                self._write_qa_batch(records)
+            except Exception as e:
+                print(f"后台写入问答日志失败: {e}")
+            finally:
+                for _ in records:
+                    self.log_queue.task_done()
+    
+    def _get_conversation_ids(self, session: Session, session_ids) -> Dict[str, int]:
+        """获取会话主键（优先使用缓存，只查询未缓存的会话）"""
+        result = {}
+        missing = set()
+        for session_id in session_ids:
+            conversation_id = self._conversation_ids.get(session_id)
+            if conversation_id is None:
+                missing.add(session_id)
+            else:
+                result[session_id] = conversation_id
+        
+        if missing:
+            found = dict(
+                session.query(Conversation.session_id, Conversation.id)
+                .filter(Conversation.session_id.in_(missing))
+                .all()
             )
-            session.add(qa_log)
-            session.commit()
-            return qa_log.id
+            self._conversation_ids.update(found)
+            result.update(found)
+        return result
+    
+    def log_qa_bulk(self, records: List[Dict]):
+        """批量记录问答日志（一条INSERT语句写入所有记录，字段与log_qa参数相同）"""
+        self._write_qa_batch(records)
+    
+    def _write_qa_batch(self, records: List[Dict]):
+        """批量写入问答日志"""
+        try:
+            with self._session() as session:
+                conversation_ids = self._get_conversation_ids(session, {record["session_id"] for record in records})
+                
+                rows = []
+                for record in records:
+                    conversation_id = conversation_ids.get(record["session_id"])
+                    if conversation_id is None:
+                        print(f"会话 {record['session_id']} 不存在，跳过问答日志")
+                        continue
+                    rows.append({
+                        "conversation_id": conversation_id,
+                        "question": record["question"],
+                        "answer": record["answer"],
+                        "citations": record.get("citations") or None,
+                        "confidence": record.get("confidence"),
+                        "response_time": record.get("response_time"),
+                        "tokens_used": record.get("tokens_used"),
+                        "model_name": record.get("model_name") or settings.MODEL_NAME,
+                        "created_at": datetime.utcnow()
+                    })
+                
+                if rows:
+                    session.execute(insert(QALog), rows)
         except SQLAlchemyError as e:
-            session.rollback()
-            print(f"记录问答失败: {e}")
+            print(f"批量记录问答失败: {e}")
             raise
-        finally:
-            session.close()
     
     def add_feedback(self, qa_log_id: int, feedback_type: str, comment: str = None) -> bool:
         """添加用户反馈"""
-        session = self.get_session()
         try:
-            feedback = UserFeedback(
-                qa_log_id=qa_log_id,
-                feedback_type=feedback_type,
-                comment=comment
-            )
-            session.add(feedback)
-            session.commit()
+            with self._session() as session:
+                session.add(UserFeedback(
+                    qa_log_id=qa_log_id,
+                    feedback_type=feedback_type,
+                    comment=comment
+                ))
             return True
         except SQLAlchemyError as e:
-            session.rollback()
             print(f"添加反馈失败: {e}")
             return False
-        finally:
-            session.close()
     
     def log_document(self, 
                      filename: str, 
@@ -118,210 +334,260 @@ class DatabaseManager:
                      chunk_count: int = None,
                      processing_time: float = None) -> int:
         """记录文档元数据"""
-        session = self.get_session()
         try:
-            doc_metadata = DocumentMetadata(
-                filename=filename,
-                file_path=file_path,
-                file_size=file_size,
-                chunk_count=chunk_count,
-                processing_time=processing_time,
-                is_processed=chunk_count is not None
-            )
-            session.add(doc_metadata)
-            session.commit()
-            return doc_metadata.id
+            with self._session() as session:
+                doc_metadata = DocumentMetadata(
+                    filename=filename,
+                    file_path=file_path,
+                    file_size=file_size,
+                    chunk_count=chunk_count,
+                    processing_time=processing_time,
+                    is_processed=chunk_count is not None
+                )
+                session.add(doc_metadata)
+                session.flush()
+                return doc_metadata.id
         except SQLAlchemyError as e:
-            session.rollback()
             print(f"记录文档失败: {e}")
             raise
-        finally:
-            session.close()
     
     def get_conversation_history(self, session_id: str) -> List[Dict]:
         """获取对话历史"""
-        session = self.get_session()
         try:
-            conversation = session.query(Conversation).filter_by(session_id=session_id).first()
-            if not conversation:
-                return []
-            
-            qa_logs = session.query(QALog).filter_by(conversation_id=conversation.id).order_by(QALog.created_at).all()
-            
-            history = []
-            for qa in qa_logs:
-                history.append({
-                    "id": qa.id,
-                    "question": qa.question,
-                    "answer": qa.answer,
-                    "citations": json.loads(qa.citations) if qa.citations else None,
-                    "confidence": qa.confidence,
-                    "created_at": qa.created_at.isoformat()
-                })
-            return history
+            with self._session() as session:
+                conversation_id = self._get_conversation_ids(session, [session_id]).get(session_id)
+                if conversation_id is None:
+                    return []
+                
+                qa_logs = session.query(QALog).filter_by(conversation_id=conversation_id).order_by(QALog.created_at).all()
+                
+                history = []
+                for qa in qa_logs:
+                    history.append({
+                        "id": qa.id,
+                        "question": qa.question,
+                        "answer": qa.answer,
+                        "citations": qa.citations or None,
+                        "confidence": qa.confidence,
+                        "created_at": qa.created_at.isoformat()
+                    })
+                return history
         except SQLAlchemyError as e:
             print(f"获取对话历史失败: {e}")
             return []
-        finally:
-            session.close()
+    
+    def _feedback_counts(self, session: Session) -> Dict[str, int]:
+        """按反馈类型统计数量（一次分组聚合查询）"""
+        from sqlalchemy import func
+        
+        rows = session.query(
+            UserFeedback.feedback_type,
+            func.count(UserFeedback.id)
+        ).group_by(UserFeedback.feedback_type).all()
+        return dict(rows)
     
     def get_stats(self) -> Dict[str, Any]:
         """获取系统统计信息"""
-        session = self.get_session()
         try:
-            stats = {}
-            
-            # 总对话数
-            stats['total_conversations'] = session.query(Conversation).count()
-            
-            # 总问答数
-            stats['total_qa'] = session.query(QALog).count()
-            
-            # 总文档数
-            stats['total_documents'] = session.query(DocumentMetadata).count()
-            
-            # 用户反馈统计
-            total_feedback = session.query(UserFeedback).count()
-            positive_feedback = session.query(UserFeedback).filter_by(feedback_type='like').count()
-            stats['feedback_rate'] = positive_feedback / total_feedback if total_feedback > 0 else 0
-            
-            return stats
+            with self._session() as session:
+                stats = {}
+                
+                # 总对话数
+                stats['total_conversations'] = session.query(Conversation).count()
+                
+                # 总问答数
+                stats['total_qa'] = session.query(QALog).count()
+                
+                # 总文档数
+                stats['total_documents'] = session.query(DocumentMetadata).count()
+                
+                # 用户反馈统计
+                feedback_counts = self._feedback_counts(session)
+                total_feedback = sum(feedback_counts.values())
+                positive_feedback = feedback_counts.get('like', 0)
+                stats['feedback_rate'] = positive_feedback / total_feedback if total_feedback > 0 else 0
+                
+                return stats
         except SQLAlchemyError as e:
             print(f"获取统计信息失败: {e}")
             return {}
-        finally:
-            session.close()
     
     def get_qa_stats(self) -> Dict[str, Any]:
         """获取问答统计"""
-        session = self.get_session()
         try:
-            from sqlalchemy import func
-            
-            # 总数和平均置信度
-            result = session.query(
-                func.count(QALog.id).label('total_count'),
-                func.avg(QALog.confidence).label('avg_confidence')
-            ).first()
-            
-            return {
-                'total_count': result.total_count or 0,
-                'avg_confidence': float(result.avg_confidence or 0.0)
-            }
+            with self._session() as session:
+                from sqlalchemy import func
+                
+                # 总数和平均置信度
+                result = session.query(
+                    func.count(QALog.id).label('total_count'),
+                    func.avg(QALog.confidence).label('avg_confidence')
+                ).first()
+                
+                return {
+                    'total_count': result.total_count or 0,
+                    'avg_confidence': float(result.avg_confidence or 0.0)
+                }
         except SQLAlchemyError as e:
             print(f"获取问答统计失败: {e}")
             return {'total_count': 0, 'avg_confidence': 0.0}
-        finally:
-            session.close()
     
     def get_document_stats(self) -> Dict[str, Any]:
         """获取文档统计"""
-        session = self.get_session()
         try:
-            from sqlalchemy import func
-            
-            result = session.query(
-                func.count(DocumentMetadata.id).label('total_count'),
-                func.sum(DocumentMetadata.chunk_count).label('total_chunks'),
-                func.avg(DocumentMetadata.processing_time).label('avg_processing_time')
-            ).first()
-            
-            return {
-                'total_count': result.total_count or 0,
-                'total_chunks': result.total_chunks or 0,
-                'avg_processing_time': float(result.avg_processing_time or 0.0)
-            }
+            with self._session() as session:
+                from sqlalchemy import func
+                
+                result = session.query(
+                    func.count(DocumentMetadata.id).label('total_count'),
+                    func.sum(DocumentMetadata.chunk_count).label('total_chunks'),
+                    func.avg(DocumentMetadata.processing_time).label('avg_processing_time')
+                ).first()
+                
+                return {
+                    'total_count': result.total_count or 0,
+                    'total_chunks': result.total_chunks or 0,
+                    'avg_processing_time': float(result.avg_processing_time or 0.0)
+                }
         except SQLAlchemyError as e:
             print(f"获取文档统计失败: {e}")
             return {'total_count': 0, 'total_chunks': 0, 'avg_processing_time': 0.0}
-        finally:
-            session.close()
     
     def get_feedback_stats(self) -> Dict[str, Any]:
         """获取反馈统计"""
-        session = self.get_session()
         try:
-            from sqlalchemy import func
-            
-            total_count = session.query(func.count(UserFeedback.id)).scalar() or 0
-            positive_count = session.query(func.count(UserFeedback.id)).filter_by(feedback_type='like').scalar() or 0
-            negative_count = session.query(func.count(UserFeedback.id)).filter_by(feedback_type='dislike').scalar() or 0
-            
-            return {
-                'total_count': total_count,
-                'positive_count': positive_count,
-                'negative_count': negative_count
-            }
+            with self._session() as session:
+                feedback_counts = self._feedback_counts(session)
+                
+                return {
+                    'total_count': sum(feedback_counts.values()),
+                    'positive_count': feedback_counts.get('like', 0),
+                    'negative_count': feedback_counts.get('dislike', 0)
+                }
         except SQLAlchemyError as e:
             print(f"获取反馈统计失败: {e}")
             return {'total_count': 0, 'positive_count': 0, 'negative_count': 0}
-        finally:
-            session.close()
     
-    def create_document_metadata(self, filename: str, file_size: int, file_path: str = None) -> DocumentMetadata:
-        """创建文档元数据记录"""
-        session = self.get_session()
+    def get_stats_bundle(self) -> Dict[str, Any]:
+        """一次性获取仪表板所需的全部统计（单个会话，一次标量子查询往返 + 一次反馈分组查询）"""
         try:
-            doc_metadata = DocumentMetadata(
-                filename=filename,
-                file_path=file_path,
-                file_size=file_size
-            )
-            session.add(doc_metadata)
-            session.commit()
-            # 刷新对象以确保ID被设置
-            session.refresh(doc_metadata)
-            # 分离对象以便在session关闭后仍可使用
-            session.expunge(doc_metadata)
-            return doc_metadata
+            with self._session() as session:
+                row = session.execute(text("""
+                    SELECT
+                        (SELECT COUNT(*) FROM conversations) as total_conversations,
+                        (SELECT COUNT(*) FROM qa_logs) as qa_count,
+                        (SELECT AVG(confidence) FROM qa_logs) as avg_confidence,
+                        (SELECT COUNT(*) FROM document_metadata) as document_count,
+                        (SELECT SUM(chunk_count) FROM document_metadata) as total_chunks,
+                        (SELECT AVG(processing_time) FROM document_metadata) as avg_processing_time
+                """)).one()
+                feedback_counts = self._feedback_counts(session)
+                
+                return {
+                    'total_conversations': row.total_conversations or 0,
+                    'qa': {
+                        'total_count': row.qa_count or 0,
+                        'avg_confidence': float(row.avg_confidence or 0.0)
+                    },
+                    'documents': {
+                        'total_count': row.document_count or 0,
+                        'total_chunks': int(row.total_chunks or 0),
+                        'avg_processing_time': float(row.avg_processing_time or 0.0)
+                    },
+                    'feedback': {
+                        'total_count': sum(feedback_counts.values()),
+                        'positive_count': feedback_counts.get('like', 0),
+                        'negative_count': feedback_counts.get('dislike', 0)
+                    }
+                }
+        except SQLAlchemyError as e:
+            print(f"获取统计信息失败: {e}")
+            return {
+                'total_conversations': 0,
+                'qa': {'total_count': 0, 'avg_confidence': 0.0},
+                'documents': {'total_count': 0, 'total_chunks': 0, 'avg_processing_time': 0.0},
+                'feedback': {'total_count': 0, 'positive_count': 0, 'negative_count': 0}
+            }
+    
+    def create_document_metadata(self, filename: str, file_size: int, file_path: str = None,
+                                 content_hash: str = None) -> DocumentMetadata:
+        """创建文档元数据记录（相同内容哈希的记录已存在时复用并更新该记录）"""
+        try:
+            with self._session() as session:
+                doc_metadata = None
+                if content_hash:
+                    doc_metadata = session.query(DocumentMetadata).filter_by(content_hash=content_hash).first()
+                
+                if doc_metadata:
+                    # 之前未处理完成的上传，复用原记录避免违反内容哈希唯一索引
+                    doc_metadata.filename = filename
+                    doc_metadata.file_path = file_path
+                    doc_metadata.file_size = file_size
+                else:
+                    doc_metadata = DocumentMetadata(
+                        filename=filename,
+                        file_path=file_path,
+                        file_size=file_size,
+                        content_hash=content_hash
+                    )
+                    session.add(doc_metadata)
+                session.flush()
+                # 刷新对象以确保ID被设置
+                session.refresh(doc_metadata)
+                # 分离对象以便在session关闭后仍可使用
+                session.expunge(doc_metadata)
+                return doc_metadata
         except SQLAlchemyError as e:
-            session.rollback()
             print(f"创建文档元数据失败: {e}")
             raise
-        finally:
-            session.close()
+    
+    def get_document_by_hash(self, content_hash: str) -> Optional[DocumentMetadata]:
+        """按内容哈希查找文档（包括尚未处理完成的记录，调用方根据is_processed判断）"""
+        try:
+            with self._session() as session:
+                doc = session.query(DocumentMetadata).filter_by(content_hash=content_hash).first()
+                if doc:
+                    session.expunge(doc)
+                return doc
+        except SQLAlchemyError as e:
+            print(f"按哈希查找文档失败: {e}")
+            return None
     
     def update_document_metadata(self, doc_id: int, **kwargs):
         """更新文档元数据"""
-        session = self.get_session()
         try:
-            doc = session.query(DocumentMetadata).filter_by(id=doc_id).first()
-            if doc:
-                for key, value in kwargs.items():
-                    if hasattr(doc, key):
-                        setattr(doc, key, value)
-                session.commit()
-                print(f"✅ 更新文档元数据成功: {kwargs}")
-            else:
-                print(f"❌ 未找到文档ID: {doc_id}")
+            with self._session() as session:
+                doc = session.get(DocumentMetadata, doc_id)
+                if doc:
+                    for key, value in kwargs.items():
+                        if hasattr(doc, key):
+                            setattr(doc, key, value)
+                    print(f"✅ 更新文档元数据成功: {kwargs}")
+                else:
+                    print(f"❌ 未找到文档ID: {doc_id}")
         except SQLAlchemyError as e:
-            session.rollback()
             print(f"更新文档元数据失败: {e}")
             raise
-        finally:
-            session.close()
     
     def get_recent_qa_for_evaluation(self, limit: int = 10) -> List[Dict]:
         """获取最近的问答记录用于评测"""
-        session = self.get_session()
         try:
-            qa_logs = session.query(QALog).order_by(QALog.created_at.desc()).limit(limit).all()
-            
-            qa_data = []
-            for qa in qa_logs:
-                qa_data.append({
-                    'question': qa.question,
-                    'answer': qa.answer,
-                    'citations': json.loads(qa.citations) if qa.citations else [],
-                    'ground_truth': qa.answer  # 这里可以后续改进为真实标准答案
-                })
-            
-            return qa_data
+            with self._session() as session:
+                qa_logs = session.query(QALog).order_by(QALog.created_at.desc()).limit(limit).all()
+                
+                qa_data = []
+                for qa in qa_logs:
+                    qa_data.append({
+                        'question': qa.question,
+                        'answer': qa.answer,
+                        'citations': qa.citations or [],
+                        'ground_truth': qa.answer  # 这里可以后续改进为真实标准答案
+                    })
+                
+                return qa_data
         except SQLAlchemyError as e:
             print(f"获取评测数据失败: {e}")
             return []
-        finally:
-            session.close()
     
     def save_evaluation_results(self, eval_results: Dict) -> int:
         """保存评测结果（需要创建EvaluationResult表）"""
@@ -335,68 +601,46 @@ class DatabaseManager:
         return []
     
     def get_analytics_data(self) -> Dict[str, Any]:
-        """获取分析数据"""
-        session = self.get_session()
+        """获取分析数据（趋势与分布为DataFrame）"""
         try:
-            from sqlalchemy import func, text
-            from datetime import datetime, timedelta
-            
-            analytics = {}
-            
-            # 每日问答趋势（最近7天）
-            seven_days_ago = datetime.now() - timedelta(days=7)
-            daily_qa = session.execute(text("""
-                SELECT DATE(created_at) as date, COUNT(*) as count 
-                FROM qa_logs 
-                WHERE created_at >= :seven_days_ago 
-                GROUP BY DATE(created_at) 
-                ORDER BY date
-            """), {"seven_days_ago": seven_days_ago}).fetchall()
-            
-            analytics['daily_qa'] = [{'date': str(row.date), 'count': row.count} for row in daily_qa]
-            
-            # 置信度分布
-            confidence_dist = session.execute(text("""
-                SELECT 
-                    CASE 
-                        WHEN confidence >= 0.8 THEN 'High (0.8+)'
-                        WHEN confidence >= 0.6 THEN 'Medium (0.6-0.8)'
-                        WHEN confidence >= 0.4 THEN 'Low (0.4-0.6)'
-                        ELSE 'Very Low (<0.4)'
-                    END as `range`,
-                    COUNT(*) as count
-                FROM qa_logs 
-                WHERE confidence IS NOT NULL
-                GROUP BY 
-                    CASE 
-                        WHEN confidence >= 0.8 THEN 'High (0.8+)'
-                        WHEN confidence >= 0.6 THEN 'Medium (0.6-0.8)'
-                        WHEN confidence >= 0.4 THEN 'Low (0.4-0.6)'
-                        ELSE 'Very Low (<0.4)'
-                    END
-            """)).fetchall()
-            
-            analytics['confidence_distribution'] = [{'range': row.range, 'count': row.count} for row in confidence_dist]
-            
-            # 反馈统计
-            feedback_stats = session.query(
-                UserFeedback.feedback_type,
-                func.count(UserFeedback.id).label('count')
-            ).group_by(UserFeedback.feedback_type).all()
-            
-            feedback_dict = {row.feedback_type: row.count for row in feedback_stats}
-            analytics['feedback_stats'] = {
-                'positive': feedback_dict.get('like', 0),
-                'negative': feedback_dict.get('dislike', 0)
-            }
-            
-            return analytics
-            
+            with self._session() as session:
+                from sqlalchemy import text
+                from datetime import datetime, timedelta
+                
+                analytics = {}
+                
+                # 每日问答趋势（最近7天）
+                seven_days_ago = datetime.now() - timedelta(days=7)
+                # 只读取created_at（ix_qa_created索引范围扫描即可覆盖），在应用端按天分桶，避免DATE()包裹列
+                created = pd.read_sql(text("""
+                    SELECT created_at
+                    FROM qa_logs 
+                    WHERE created_at >= :seven_days_ago 
+                """), session.connection(), params={"seven_days_ago": seven_days_ago}, parse_dates=["created_at"])
+                daily_counts = created["created_at"].dt.date.value_counts().sort_index()
+                analytics['daily_qa'] = daily_counts.rename_axis("date").to_frame("count")
+                
+                # 置信度分布：SQL只按FLOOR(confidence*5)分组（ix_qa_confidence索引扫描），区间标签在应用端映射
+                buckets = pd.read_sql(text("""
+                    SELECT FLOOR(confidence * 5) as bucket, COUNT(*) as count
+                    FROM qa_logs 
+                    WHERE confidence IS NOT NULL
+                    GROUP BY bucket
+                """), session.connection())
+                analytics['confidence_distribution'] = confidence_distribution(buckets)
+                
+                # 反馈统计
+                feedback_dict = self._feedback_counts(session)
+                analytics['feedback_stats'] = {
+                    'positive': feedback_dict.get('like', 0),
+                    'negative': feedback_dict.get('dislike', 0)
+                }
+                
+                return analytics
+                
         except SQLAlchemyError as e:
             print(f"获取分析数据失败: {e}")
             return {}
-        finally:
-            session.close()
 
 # 创建全局数据库管理器实例
 db_manager = DatabaseManager()
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey, Index, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -21,12 +21,20 @@ class Conversation(Base):
 class QALog(Base):
     """问答记录表"""
     __tablename__ = 'qa_logs'
+    __table_args__ = (
+        # 按会话查询历史（WHERE conversation_id = ? ORDER BY created_at）
+        Index('ix_qa_conv_created', 'conversation_id', 'created_at'),
+        # 最近问答和按日期范围统计
+        Index('ix_qa_created', 'created_at'),
+        # 置信度分布统计
+        Index('ix_qa_confidence', 'confidence'),
+    )
     
     id = Column(Integer, primary_key=True)
     conversation_id = Column(Integer, ForeignKey('conversations.id'))
     question = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
-    citations = Column(Text)  # JSON格式存储引用片段
+    citations = Column(JSON(none_as_null=True))  # 引用片段（MySQL原生JSON列，读写时由驱动层序列化）
     confidence = Column(Float)  # 答案置信度
     response_time = Column(Float)  # 响应时间(秒)
     tokens_used = Column(Integer)  # 使用的token数量
@@ -52,11 +60,16 @@ class UserFeedback(Base):
 class DocumentMetadata(Base):
     """文档元数据表"""
     __tablename__ = 'document_metadata'
+    __table_args__ = (
+        # 按内容哈希去重（唯一索引，NULL不参与唯一性约束）
+        Index('ux_doc_content_hash', 'content_hash', unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
     filename = Column(String(255), nullable=False)
     file_path = Column(String(500))
     file_size = Column(Integer)  # 文件大小(字节)
+    content_hash = Column(String(64))  # 文件内容SHA-256，用于去重
     chunk_count = Column(Integer)  # 分块数量
     upload_time = Column(DateTime, default=datetime.utcnow)
     is_processed = Column(Boolean, default=False)
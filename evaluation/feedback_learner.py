@@ -8,17 +8,14 @@ from typing import Dict, List, Optional, Tuple
 from database.db_manager import db_manager
 from database.models import UserFeedback, QALog
 from sqlalchemy import desc, func
-import openai
+from core.openai_client import openai_client
 from config.settings import settings
 
 class FeedbackLearner:
     """基于反馈的学习器"""
     
     def __init__(self):
-        self.client = openai.OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_API_BASE
-        )
+        self.client = openai_client
         
         # 反馈分析提示模板
         self.feedback_analysis_prompt = """
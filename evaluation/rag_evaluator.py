@@ -4,20 +4,18 @@ RAGAS自动化评测模块
 """
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Tuple
 from database.db_manager import db_manager
 from core.enhanced_rag_chain import enhanced_rag_chain
-import openai
+from core.openai_client import openai_client
 from config.settings import settings
 
 class RAGEvaluator:
     """RAG系统评测器"""
     
     def __init__(self):
-        self.client = openai.OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_API_BASE
-        )
+        self.client = openai_client
         
         # 评测指标的提示模板
         self.faithfulness_prompt = """
@@ -166,10 +164,14 @@ AI回答: {answer}
         
         start_time = time.time()
         
-        # 并发评估各项指标
-        faithfulness = self.evaluate_faithfulness(question, answer, context)
-        relevance = self.evaluate_relevance(question, answer)
-        completeness = self.evaluate_completeness(question, answer)
+        # 并发评估各项指标（三次LLM调用相互独立）
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            faithfulness_future = executor.submit(self.evaluate_faithfulness, question, answer, context)
+            relevance_future = executor.submit(self.evaluate_relevance, question, answer)
+            completeness_future = executor.submit(self.evaluate_completeness, question, answer)
+            faithfulness = faithfulness_future.result()
+            relevance = relevance_future.result()
+            completeness = completeness_future.result()
         
         # 计算综合分数
         overall_score = (faithfulness * 0.4 + relevance * 0.4 + completeness * 0.2)
@@ -2,7 +2,7 @@
 RAG评估器 - 简化版本
 实现基本的忠实度、相关性、召回率评测
 """
-import openai
+from core.openai_client import openai_client
 from typing import List, Dict, Any
 from config.settings import settings
 import json
@@ -13,10 +13,7 @@ class RAGEvaluator:
     """RAG系统评估器"""
     
     def __init__(self):
-        self.client = openai.OpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            base_url=settings.OPENAI_API_BASE
-        )
+        self.client = openai_client
     
     def evaluate_faithfulness(self, answer: str, citations: List[Dict]) -> float:
         """评估答案忠实度 - 答案是否基于给定的上下文"""
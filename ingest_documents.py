@@ -1,5 +1,6 @@
 from core.document_loader import document_loader
 from core.vector_store_compatible import vector_store
+from core.hyde_retrieval import hyde_retriever
 from database.db_manager import db_manager
 import os
 import time
@@ -21,6 +22,7 @@ def ingest_document(file_path: str):
         
         # 2. 向量化存储
         vector_ids = vector_store.add_documents(chunks)
+        hyde_retriever.index_hypothetical_questions(chunks)
         
         # 3. 记录到数据库
         file_size = os.path.getsize(file_path)
@@ -0,0 +1,52 @@
+"""
+置信度分布统计测试
+验证 FLOOR(confidence*5) 分桶合并后的区间与原CASE表达式的区间一致
+"""
+import math
+import pandas as pd
+from database.db_manager import confidence_distribution
+
+# 边界值及区间内的代表值
+CONFIDENCE_VALUES = [0.0, 0.1, 0.399, 0.4, 0.5, 0.599, 0.6, 0.7, 0.799, 0.8, 0.95, 1.0]
+
+def case_label(confidence: float) -> str:
+    """原SQL中CASE表达式的区间划分"""
+    if confidence >= 0.8:
+        return 'High (0.8+)'
+    if confidence >= 0.6:
+        return 'Medium (0.6-0.8)'
+    if confidence >= 0.4:
+        return 'Low (0.4-0.6)'
+    return 'Very Low (<0.4)'
+
+def sql_buckets(values) -> pd.DataFrame:
+    """模拟 SELECT FLOOR(confidence * 5) AS bucket, COUNT(*) ... GROUP BY bucket 的结果"""
+    buckets = pd.Series([float(math.floor(value * 5)) for value in values])
+    counts = buckets.value_counts()
+    return pd.DataFrame({"bucket": counts.index, "count": counts.values})
+
+def test_edge_values_match_case_labels():
+    """每个边界值单独分桶后落入与CASE表达式相同的区间"""
+    for value in CONFIDENCE_VALUES:
+        distribution = confidence_distribution(sql_buckets([value]))
+        assert distribution.index.tolist() == [case_label(value)], value
+        assert distribution["count"].tolist() == [1]
+
+def test_distribution_matches_case_counts():
+    """整体分布与按CASE表达式统计的结果一致"""
+    expected = pd.Series([case_label(value) for value in CONFIDENCE_VALUES]).value_counts()
+    distribution = confidence_distribution(sql_buckets(CONFIDENCE_VALUES))
+
+    assert distribution.index.name == "range"
+    assert distribution["count"].to_dict() == expected.to_dict()
+
+def test_empty_distribution():
+    """没有问答记录时返回空分布"""
+    distribution = confidence_distribution(pd.DataFrame({"bucket": [], "count": []}))
+    assert distribution.empty
+
+if __name__ == "__main__":
+    test_edge_values_match_case_labels()
+    test_distribution_matches_case_counts()
+    test_empty_distribution()
+    print("置信度分布测试通过")
@@ -0,0 +1,84 @@
+"""
+批量问答测试
+使用模拟的OpenAI客户端验证ask_batch的结果分发与逐题错误处理
+"""
+from types import SimpleNamespace
+from langchain.schema import Document
+from core.enhanced_rag_chain import EnhancedRAGChain
+import orjson
+
+class FakeBatchClient:
+    """模拟支持Batch API的OpenAI客户端：每个请求返回 "答案<custom_id>" """
+
+    def __init__(self):
+        self.requests = []
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._create_batch)
+
+    def _create_file(self, file, purpose):
+        self.requests = [orjson.loads(line) for line in file[1].splitlines()]
+        return SimpleNamespace(id="file-input")
+
+    def _create_batch(self, *args, **kwargs):
+        return SimpleNamespace(id="batch-1", status="completed", output_file_id="file-output")
+
+    def _file_content(self, file_id):
+        lines = [
+            orjson.dumps({
+                "custom_id": request["custom_id"],
+                "response": {"body": {
+                    "choices": [{"message": {"content": f"答案{request['custom_id']}"}}],
+                    "usage": {"total_tokens": 10}
+                }}
+            }).decode()
+            for request in self.requests
+        ]
+        return SimpleNamespace(text="\n".join(lines))
+
+def make_chain(client):
+    """构建使用模拟客户端的问答链，检索到“失败”问题时抛出异常"""
+    chain = EnhancedRAGChain()
+    chain.client = client
+
+    def fake_retrieve(question, method, candidates=None):
+        if "失败" in question:
+            raise RuntimeError("检索失败")
+        return [(Document(page_content=f"{question} 相关内容", metadata={"source_file": "a.txt"}), None)]
+
+    chain._retrieve = fake_retrieve
+    return chain
+
+def test_ask_batch_distributes_results():
+    """批处理结果按custom_id分发回对应问题"""
+    chain = make_chain(FakeBatchClient())
+    results = chain.ask_batch(["问题一", "问题二"], method="basic")
+
+    assert [r["answer"] for r in results] == ["答案0", "答案1"]
+    assert all(r["confidence"] > 0 and r["citations"] for r in results)
+    assert results[0]["tokens_used"] == 10
+
+def test_ask_batch_isolates_retrieval_errors():
+    """单个问题检索失败只产生该问题的错误结果，其余问题照常提交"""
+    client = FakeBatchClient()
+    chain = make_chain(client)
+    results = chain.ask_batch(["问题一", "检索失败的问题", "问题三"], method="basic")
+
+    assert [r["custom_id"] for r in client.requests] == ["0", "2"]
+    assert results[1]["confidence"] == 0.0 and "检索失败" in results[1]["answer"]
+    assert results[0]["answer"] == "答案0" and results[2]["answer"] == "答案2"
+
+def test_ask_batch_requires_batch_api():
+    """openai SDK不支持Batch API时直接抛出明确错误"""
+    chain = make_chain(SimpleNamespace())
+    try:
+        chain.ask_batch(["问题一"])
+    except RuntimeError as e:
+        assert "Batch API" in str(e)
+    else:
+        raise AssertionError("缺少Batch API时应抛出RuntimeError")
+
+if __name__ == "__main__":
+    test_ask_batch_distributes_results()
+    test_ask_batch_isolates_retrieval_errors()
+    test_ask_batch_requires_batch_api()
+    print("批量问答测试通过")
@@ -0,0 +1,53 @@
+"""
+计算器工具测试
+验证AST白名单校验、常量类型限制和幂运算指数上限
+"""
+from core.intelligent_agent import ToolRegistry, compile_expression, CALCULATOR_MAX_EXPONENT
+
+def evaluate(expression):
+    return eval(compile_expression(expression), {"__builtins__": {}}, {})
+
+def assert_rejected(expression):
+    try:
+        compile_expression(expression)
+    except ValueError:
+        return
+    raise AssertionError(f"表达式应被拒绝: {expression}")
+
+def test_arithmetic():
+    """基本算术运算"""
+    assert evaluate("3*(4+5)/2") == 13.5
+    assert evaluate("7 // 2 + 7 % 2") == 4
+    assert evaluate("-2**-1") == -0.5
+
+def test_rejected_nodes():
+    """函数调用、属性访问、名称等节点被拒绝"""
+    for expression in ("__import__('os')", "(1).__class__", "x + 1", "[1, 2]", "1 if 1 else 2"):
+        assert_rejected(expression)
+
+def test_only_numeric_constants():
+    """布尔值和字符串常量被拒绝"""
+    for expression in ("True + 1", "'a' * 3", "b'a' * 3"):
+        assert_rejected(expression)
+
+def test_exponent_limit():
+    """指数必须是不超过上限的数字常量，底数中不能嵌套幂运算"""
+    assert evaluate(f"2**{CALCULATOR_MAX_EXPONENT}") == 2 ** CALCULATOR_MAX_EXPONENT
+    assert evaluate(f"2**-{CALCULATOR_MAX_EXPONENT}") == 2 ** -CALCULATOR_MAX_EXPONENT
+    for expression in ("9**9**9**9", f"2**{CALCULATOR_MAX_EXPONENT + 1}", "2**(50+51)", "(2**100)**100"):
+        assert_rejected(expression)
+
+def test_calculator_tool():
+    """计算器工具返回结果或错误信息"""
+    registry = ToolRegistry()
+    assert registry._calculator("1+2")["result"] == 3
+    assert "error" in registry._calculator("9**9**9**9")
+    assert "error" in registry._calculator("import os")
+
+if __name__ == "__main__":
+    test_arithmetic()
+    test_rejected_nodes()
+    test_only_numeric_constants()
+    test_exponent_limit()
+    test_calculator_tool()
+    print("计算器测试通过")
@@ -0,0 +1,44 @@
+"""
+会话级问答缓存测试
+验证app.py中的LRU缓存淘汰和出错结果不缓存
+"""
+from collections import OrderedDict
+from types import SimpleNamespace
+import app
+
+def use_fresh_cache():
+    """以普通对象替代st.session_state，脱离Streamlit运行时测试缓存逻辑"""
+    app.st = SimpleNamespace(session_state=SimpleNamespace(qa_cache=OrderedDict()))
+
+def test_cache_hit_ignores_case_and_whitespace():
+    """问题归一化后命中同一缓存项"""
+    use_fresh_cache()
+    result = {"answer": "RAG是检索增强生成", "confidence": 0.8, "citations": []}
+    app.cache_answer(app.qa_cache_key("basic", "什么是RAG？"), result)
+
+    assert app.get_cached_answer(app.qa_cache_key("basic", "  什么是rag？ ")) is result
+    assert app.get_cached_answer(app.qa_cache_key("hyde", "什么是RAG？")) is None
+
+def test_cache_evicts_least_recently_used():
+    """超出容量时淘汰最久未使用的结果"""
+    use_fresh_cache()
+    for i in range(app.QA_CACHE_SIZE + 1):
+        app.cache_answer(app.qa_cache_key("basic", f"问题{i}"), {"answer": str(i)})
+
+    assert len(app.st.session_state.qa_cache) == app.QA_CACHE_SIZE
+    assert app.get_cached_answer(app.qa_cache_key("basic", "问题0")) is None
+
+def test_error_result_not_cached():
+    """出错结果不写入缓存，下次提问重新生成"""
+    use_fresh_cache()
+    error_result = {"answer": "抱歉，回答问题时出现错误：timeout", "confidence": 0.0, "citations": [], "error": True}
+    key = app.qa_cache_key("enhanced", "什么是RAG？")
+    app.cache_answer(key, error_result)
+
+    assert app.get_cached_answer(key) is None
+
+if __name__ == "__main__":
+    test_cache_hit_ignores_case_and_whitespace()
+    test_cache_evicts_least_recently_used()
+    test_error_result_not_cached()
+    print("问答缓存测试通过")
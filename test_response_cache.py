@@ -0,0 +1,52 @@
+"""
+语义响应缓存测试
+使用固定的问题向量验证命中阈值、清空和知识库更新后的失效
+"""
+from core.response_cache import SemanticResponseCache
+from core.vector_store_compatible import vector_store
+from core.qa_chain_simple import SimpleRAGChain
+
+# 前两个问题语义相近（余弦相似度约0.99），第三个无关
+QUESTION_VECTORS = {
+    "什么是RAG？": [1.0, 0.0, 0.0],
+    "RAG是什么？": [0.99, 0.1, 0.0],
+    "今天天气如何？": [0.0, 0.0, 1.0]
+}
+
+def make_cache():
+    return SemanticResponseCache(max_entries=4, ttl=60, sim_threshold=0.93, embed_fn=QUESTION_VECTORS.__getitem__)
+
+def test_lookup_matches_similar_questions():
+    """相近问题命中，无关问题未命中"""
+    cache = make_cache()
+    cache.insert("什么是RAG？", {"question": "什么是RAG？", "answer": "检索增强生成"})
+
+    assert cache.lookup("RAG是什么？")["answer"] == "检索增强生成"
+    assert cache.lookup("今天天气如何？") is None
+
+def test_clear_drops_all_entries():
+    """清空后不再命中"""
+    cache = make_cache()
+    cache.insert("什么是RAG？", {"answer": "检索增强生成"})
+    cache.clear()
+
+    assert cache.lookup("什么是RAG？") is None
+
+def test_chain_cache_invalidated_by_vector_store():
+    """问答链的回答缓存随向量库缓存一起清空，命中时返回调用方的问题"""
+    chain = SimpleRAGChain()
+    chain.cache.embed_fn = QUESTION_VECTORS.__getitem__
+    chain.cache.insert("什么是RAG？", {"question": "什么是RAG？", "answer": "检索增强生成", "confidence": 0.8})
+
+    hit = chain.ask("RAG是什么？")
+    assert hit["cache"] == "semantic_hit"
+    assert hit["question"] == "RAG是什么？"
+
+    vector_store.clear_caches()
+    assert chain.cache.lookup("什么是RAG？") is None
+
+if __name__ == "__main__":
+    test_lookup_matches_similar_questions()
+    test_clear_drops_all_entries()
+    test_chain_cache_invalidated_by_vector_store()
+    print("语义响应缓存测试通过")